@@ -1,14 +1,23 @@
 # ai_core.py
 
 import os
+import io
 import json
 import traceback
 import hashlib
 import functools
 import time
 import logging
+import threading
+from contextlib import contextmanager
 
-from transformers import AutoTokenizer, AutoModelForSeq2SeqLM
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, StoppingCriteriaList
+
+from assisted_decoding import AssistedStats, assisted_generate, load_draft_model
+from code_stopping import PythonStopCriteria, StopStats, trim_code_output
+from dataset_reader import iter_field
+from dataset_writer import get_writer
+from shared_weights import base_fingerprint, load_mmap_model
 # from transformers import AutoTokenizer, AutoModelForCausalLM
 # MODEL_NAME = "gpt2"
 # CACHE_DIR = os.path.expanduser("~/.cache/huggingface/transformers")
@@ -23,13 +32,150 @@ DATASET_FILE = "./datasets/python_articles.jsonl"
 tokenizer = AutoTokenizer.from_pretrained(MODEL_PATH)
 # model = AutoModelForCausalLM.from_pretrained(MODEL_PATH)
 # model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+if os.environ.get("PYTHOR_MMAP_WEIGHTS") == "1":
+    # Weights stay in the page cache and are shared by every process (see serve.py)
+    model = load_mmap_model(MODEL_PATH, AutoModelForSeq2SeqLM)
+else:
+    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_PATH)
+# Adapters are only valid for the exact base weights they were trained against
+BASE_FINGERPRINT = base_fingerprint(MODEL_PATH)
 MAX_MODEL_LENGTH = tokenizer.model_max_length 
 
-def generate_response(prompt: str, max_tokens=150):
+# Assisted generation: a small draft model proposes tokens that the model above verifies
+DRAFT_MODEL_PATH = os.environ.get("PYTHOR_DRAFT_MODEL", "Salesforce/codet5-small")
+ASSISTED_BY_DEFAULT = os.environ.get("PYTHOR_ASSISTED", "0") == "1"
+assisted_stats = AssistedStats()
+_draft_model = None
+_draft_model_lock = threading.Lock()
+
+def get_draft_model():
+    global _draft_model
+    with _draft_model_lock:
+        if _draft_model is None:
+            _draft_model = load_draft_model(DRAFT_MODEL_PATH, model, tokenizer)
+        return _draft_model
+
+# Stop decoding once the output is complete Python (closing fence, end marker or a
+# syntactically complete unit) instead of always running to max_length
+SYNTAX_STOP_BY_DEFAULT = os.environ.get("PYTHOR_SYNTAX_STOP", "1") == "1"
+stop_stats = StopStats()
+
+class _ReadWriteLock:
+    """Many readers or one writer; a waiting writer blocks new readers so it cannot starve."""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writing = False
+        self._writers_waiting = 0
+
+    @contextmanager
+    def read(self):
+        with self._cond:
+            while self._writing or self._writers_waiting:
+                self._cond.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._readers -= 1
+                if not self._readers:
+                    self._cond.notify_all()
+
+    @contextmanager
+    def write(self):
+        with self._cond:
+            self._writers_waiting += 1
+            while self._writing or self._readers:
+                self._cond.wait()
+            self._writers_waiting -= 1
+            self._writing = True
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._writing = False
+                self._cond.notify_all()
+
+# LoRA adapters trained incrementally by train_adapter.py. A new adapter is hot-loaded
+# on the next request; the base model is never reloaded. Generations hold the model
+# lock for reading and the swap holds it for writing, so a request never sees the
+# adapter change (or get deleted) partway through generate().
+ADAPTER_STATE_FILE = "./adapters/state.json"
+_adapter = {"mtime": None, "path": None, "name": None}
+_adapter_lock = threading.Lock()
+_model_lock = _ReadWriteLock()
+
+def refresh_adapter():
+    global model
+    try:
+        mtime = os.stat(ADAPTER_STATE_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return
+    if mtime == _adapter["mtime"]:
+        return
+
+    with _adapter_lock:
+        if mtime == _adapter["mtime"]:
+            return
+        _adapter["mtime"] = mtime
+        try:
+            with open(ADAPTER_STATE_FILE, "r", encoding="utf-8") as f:
+                state = json.load(f)
+            path = state.get("latest")
+            if not path or path == _adapter["path"] or not os.path.isdir(path):
+                return
+            if state.get("base") != BASE_FINGERPRINT:
+                print(f"⚠️ Skipping adapter {path}: it was trained against different base weights "
+                      f"than the loaded {MODEL_PATH}. Restart to load the new base model.")
+                return
+
+            from peft import PeftModel
+
+            name = os.path.basename(os.path.normpath(path))
+            with _model_lock.write():
+                if _adapter["name"] is None:
+                    model = PeftModel.from_pretrained(model, path, adapter_name=name)
+                else:
+                    model.load_adapter(path, adapter_name=name)
+                    model.set_adapter(name)
+                    model.base_model.delete_adapter(_adapter["name"])
+                model.eval()
+            _adapter.update(path=path, name=name)
+            print(f"🔌 Loaded adapter: {path}")
+        except Exception as e:
+            print(f"⚠️ Failed to load adapter: {e}")
+
+def generate_response(prompt: str, max_tokens=150, assisted=None, num_draft_tokens=5, stopping_criteria=None,
+                      syntax_stop=None):
+    """
+    Generate a response for `prompt`. With assisted=True (or PYTHOR_ASSISTED=1) decoding
+    is greedy and speculative: the draft model proposes `num_draft_tokens` tokens per
+    step and the full model verifies them. Acceptance metrics go to `assisted_stats`.
+    `stopping_criteria` (e.g. a request deadline) can end decoding early. With
+    syntax_stop=True (the default unless PYTHOR_SYNTAX_STOP=0) decoding also stops once
+    the output is complete Python; tokens saved (an upper bound) go to `stop_stats`.
+    """
+    if assisted is None:
+        assisted = ASSISTED_BY_DEFAULT
+    if syntax_stop is None:
+        syntax_stop = SYNTAX_STOP_BY_DEFAULT
+
+    refresh_adapter()
+    stopping_criteria = StoppingCriteriaList(stopping_criteria or [])
+
     input_ids = tokenizer.encode(prompt.strip(), return_tensors="pt")
     input_length = input_ids.shape[1]
     max_length = min(input_length + max_tokens, tokenizer.model_max_length)
+    # Leading output ids that are not generated text: the decoder start token for
+    # encoder-decoder models, the echoed prompt for causal ones
+    prompt_length = 1 if model.config.is_encoder_decoder else input_length
+
+    code_stop = None
+    if syntax_stop:
+        code_stop = PythonStopCriteria(tokenizer, prompt_length, max_length)
+        stopping_criteria.append(code_stop)
 
     # output = model.generate(
     #     input_ids,
@@ -41,30 +187,47 @@ def generate_response(prompt: str, max_tokens=150):
     #     pad_token_id=tokenizer.eos_token_id
     # )
 
-    output = model.generate(
-        input_ids,
-        max_length=max_length,
-        pad_token_id=tokenizer.eos_token_id,
-        eos_token_id=tokenizer.eos_token_id,
-        no_repeat_ngram_size=2,        # Prevent 2-gram repeats
-        repetition_penalty=1.2,        # Penalize repeated tokens
-        num_beams=3,                   # Greedy/beam search instead of pure sampling
-        early_stopping=True,
-    )
+    with _model_lock.read():
+        if assisted:
+            output = assisted_generate(
+                model,
+                get_draft_model(),
+                input_ids,
+                num_draft_tokens=num_draft_tokens,
+                stats=assisted_stats,
+                max_length=max_length,
+                pad_token_id=tokenizer.eos_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                no_repeat_ngram_size=2,
+                repetition_penalty=1.2,
+                stopping_criteria=stopping_criteria,
+            )
+        else:
+            output = model.generate(
+                input_ids=input_ids,
+                max_length=max_length,
+                pad_token_id=tokenizer.eos_token_id,
+                eos_token_id=tokenizer.eos_token_id,
+                no_repeat_ngram_size=2,        # Prevent 2-gram repeats
+                repetition_penalty=1.2,        # Penalize repeated tokens
+                num_beams=3,                   # Greedy/beam search instead of pure sampling
+                early_stopping=True,
+                stopping_criteria=stopping_criteria,
+            )
 
     # result = tokenizer.decode(output[0], skip_special_tokens=True)
     # result = result.replace(prompt, "").strip()
-    generated_ids = output[0][input_ids.shape[-1]:]     # drop the prompt tokens
+    generated_ids = output[0][prompt_length:]     # drop the prompt / decoder start token
     result = tokenizer.decode(generated_ids, skip_special_tokens=True)
 
-    # 🔧 Remove any extra Markdown code block markers
-    lines = result.splitlines()
-    cleaned = []
-    for line in lines:
-        if line.strip().startswith("```"):
-            continue
-        cleaned.append(line)
-    return "\n".join(cleaned).strip()
+    if code_stop is not None:
+        saved = code_stop.tokens_saved()
+        stop_stats.add(output.shape[1] - prompt_length, saved)
+        if saved:
+            print(f"✂️ Output complete early; saved up to {saved} of {max_length - prompt_length} token(s)")
+
+    # 🔧 Keep just the code: cut at end markers / closing fence / completion point, drop Markdown fence lines
+    return trim_code_output(result, stopped_early=code_stop is not None and code_stop.stopped_at is not None)
 
 def run_python_code(code: str):
     try:
@@ -85,43 +248,69 @@ def hash_entry(instruction: str, code: str) -> str:
     normalized = f"{instruction.strip()}\n{code.strip()}"
     return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
 
+# Hashes of the entries already in DATASET_FILE, plus how far into the file we have read.
+# Only lines appended since the last save (by this or another worker) are re-hashed.
+_dataset_hashes = {"offset": 0, "hashes": set()}
+_dataset_hashes_lock = threading.Lock()
+
+def _refresh_dataset_hashes():
+    if not os.path.exists(DATASET_FILE):
+        _dataset_hashes.update(offset=0, hashes=set())
+        return
+
+    if os.path.getsize(DATASET_FILE) < _dataset_hashes["offset"]:
+        # File was truncated or rewritten; start over
+        _dataset_hashes.update(offset=0, hashes=set())
+
+    with open(DATASET_FILE, "rb") as f:
+        f.seek(_dataset_hashes["offset"])
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial line still being written; pick it up next time
+            _dataset_hashes["offset"] += len(line)
+            try:
+                item = json.loads(line.decode("utf-8").strip())
+                h = hash_entry(item.get("instruction", ""), item.get("code", ""))
+                _dataset_hashes["hashes"].add(h)
+            except (json.JSONDecodeError, UnicodeDecodeError, AttributeError):
+                continue
+
 def save_to_dataset(instruction: str, code: str):
     new_hash = hash_entry(instruction, code)
-    existing_hashes = set()
-
-    if os.path.exists(DATASET_FILE):
-        with open(DATASET_FILE, "r", encoding="utf-8") as f:
-            for line in f:
-                try:
-                    item = json.loads(line.strip())
-                    h = hash_entry(item.get("instruction", ""), item.get("code", ""))
-                    existing_hashes.add(h)
-                except json.JSONDecodeError:
-                    continue
 
-    if new_hash in existing_hashes:
-        return False, "⚠️ Duplicate entry not saved."
-    else:
-        with open(DATASET_FILE, "a", encoding="utf-8") as f:
-            json.dump({"instruction": instruction, "code": code}, f)
-            f.write("\n")
+    with _dataset_hashes_lock:
+        _refresh_dataset_hashes()
+        if new_hash in _dataset_hashes["hashes"]:
+            return False, "⚠️ Duplicate entry not saved."
+
+        get_writer(DATASET_FILE).write({"instruction": instruction, "code": code})
+        _dataset_hashes["hashes"].add(new_hash)
         return True, "✅ Entry saved to dataset."
 
-def load_json_dataset(path=DATASET_FILE):
+def load_json_dataset(path=DATASET_FILE, max_chars=None):
+    """
+    Join the `code` field of every record into one context string.
+    Records are streamed from disk; with `max_chars` set, reading stops as soon
+    as the limit is reached, so memory stays bounded however large the file is.
+    """
     if os.path.exists(path):
         try:
-            texts = []
-            with open(path, "r", encoding="utf-8") as f:
-                for line in f:
-                    try:
-                        item = json.loads(line.strip())
-                        if isinstance(item, dict) and "code" in item:
-                            texts.append(item["code"])
-                    except json.JSONDecodeError:
-                        continue
-            return "\n".join(texts)
+            buf = io.StringIO()
+            size = 0
+            for code in iter_field(path, "code"):
+                if not isinstance(code, str):
+                    continue
+                if max_chars is not None and size and size + 1 >= max_chars:
+                    break  # no room for the separator and any of the next record
+                if size:
+                    buf.write("\n")
+                    size += 1
+                if max_chars is not None and size + len(code) > max_chars:
+                    buf.write(code[:max(max_chars - size, 0)])
+                    break
+                buf.write(code)
+                size += len(code)
+            return buf.getvalue()
         except Exception as e:
             print(f"⚠️ Failed to load dataset: {e}")
     return ""
-
-#  
\ No newline at end of file
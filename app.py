@@ -2,9 +2,9 @@
 
 import os
 from flask import Flask, request, render_template
-from transformers import AutoModelForSeq2SeqLM, AutoTokenizer
-from ai_core import generate_response, run_python_code, save_to_dataset
+from ai_core import generate_response, run_python_code, save_to_dataset, assisted_stats, stop_stats
 from crawler import crawl_and_save
+from request_scheduler import GenerationScheduler, OverloadedError, RequestCancelled, client_disconnected
 
 app = Flask(__name__)
 
@@ -15,8 +15,14 @@ MODEL_NAME = "./trained-model"
 CACHE_DIR = os.path.expanduser("~/.cache/huggingface/transformers")
 DATASET_FILE = "./datasets/python_articles.jsonl"
 
-tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME, cache_dir=CACHE_DIR)
-model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME, cache_dir=CACHE_DIR)
+# The model and tokenizer are loaded once, in ai_core; a second copy here would double memory per worker
+
+# Admission control: bounded concurrency and queue, and a deadline for every generation
+scheduler = GenerationScheduler(
+    max_concurrent=int(os.environ.get("PYTHOR_MAX_CONCURRENT", "1")),
+    max_queue=int(os.environ.get("PYTHOR_MAX_QUEUE", "4")),
+    deadline_seconds=float(os.environ.get("PYTHOR_DEADLINE_SECONDS", "30")),
+)
 
 @app.route("/", methods=["GET", "POST"])
 def index():
@@ -33,13 +39,34 @@ def index():
             user_input = request.form.get("instruction", "").strip()
             user_code = request.form.get("code", "").strip()
             should_save = "save_to_dataset" in request.form
+            use_assisted = "assisted" in request.form
 
             if not user_input:
                 code_status = "❌ Instruction is required to generate response."
             else:
                 prompt = f"# Task: {user_input}\n\n# Solution:\n"
 
-                response = generate_response(prompt)
+                try:
+                    with scheduler.admit(is_cancelled=lambda: client_disconnected(request.environ)) as ticket:
+                        response = generate_response(
+                            prompt,
+                            assisted=use_assisted,
+                            stopping_criteria=[ticket.stopping_criteria()]
+                        )
+                    if ticket.stop_reason == "cancelled":
+                        return "", 499  # client closed the connection; nobody is listening
+                    if ticket.stop_reason == "deadline":
+                        code_status = "⏱️ Time limit reached; the response below is incomplete."
+                except OverloadedError as e:
+                    page = render_template("index.html",
+                                           user_input=user_input,
+                                           user_code=user_code,
+                                           response="",
+                                           code_status=f"🚦 Server busy: {e} Please try again shortly.",
+                                           crawl_status="")
+                    return page, 503, {"Retry-After": "5"}
+                except RequestCancelled:
+                    return "", 499
 
                 if should_save and user_code:
                     success, result = run_python_code(user_code)
@@ -67,7 +94,8 @@ def index():
                 max_pages=10,
                 allowed_domains={"realpython.com", "geeksforgeeks.org"},
                 append=True,
-                max_depth=2
+                max_depth=2,
+                archive_file="./datasets/web_archive.jsonl.gz"
             )
 
             crawl_status = "✅ Crawling complete."
@@ -79,5 +107,17 @@ def index():
                            code_status=code_status,
                            crawl_status=crawl_status)
 
+@app.route("/stats/scheduler")
+def scheduler_metrics():
+    return scheduler.snapshot()
+
+@app.route("/stats/assisted")
+def assisted_metrics():
+    return assisted_stats.as_dict()
+
+@app.route("/stats/stopping")
+def stopping_metrics():
+    return stop_stats.as_dict()
+
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,127 @@
+# assisted_decoding.py
+
+"""
+Assisted (speculative) generation with a small draft model.
+
+The draft model proposes a few tokens at a time and the full model verifies
+them in a single forward pass, keeping the longest prefix it agrees with plus
+one token of its own. Under greedy decoding the result is exactly what the
+full model would have produced on its own; it just takes fewer full-model
+forward passes when the draft guesses well.
+
+The draft must share the full model's tokenizer. For ./trained-model
+(fine-tuned from codeT5-base) that means a CodeT5 checkpoint such as
+Salesforce/codet5-small; GPT-2 uses a different vocabulary and cannot be used.
+
+transformers runs the actual decoding loop (generate(assistant_model=...));
+this module counts forward passes of both models to report how many draft
+tokens were proposed and accepted.
+"""
+
+import threading
+
+import torch
+from transformers import AutoTokenizer, AutoModelForSeq2SeqLM, AutoModelForCausalLM
+
+DRAFT_MODEL_NAME = "Salesforce/codet5-small"
+NUM_DRAFT_TOKENS = 5
+
+
+class AssistedStats:
+    def __init__(self):
+        self.requests = 0
+        self.rounds = 0          # full-model verification passes
+        self.proposed = 0        # draft tokens proposed
+        self.accepted = 0        # draft tokens the full model agreed with
+        self.new_tokens = 0      # tokens generated
+        self._lock = threading.Lock()
+
+    def add(self, rounds, proposed, new_tokens):
+        accepted = min(max(new_tokens - rounds, 0), proposed)
+        with self._lock:
+            self.requests += 1
+            self.rounds += rounds
+            self.proposed += proposed
+            self.accepted += accepted
+            self.new_tokens += new_tokens
+        return accepted
+
+    @property
+    def acceptance_rate(self):
+        return self.accepted / self.proposed if self.proposed else 0.0
+
+    def as_dict(self):
+        return {
+            "requests": self.requests,
+            "rounds": self.rounds,
+            "proposed": self.proposed,
+            "accepted": self.accepted,
+            "new_tokens": self.new_tokens,
+            "acceptance_rate": self.acceptance_rate,
+            "tokens_per_round": self.new_tokens / self.rounds if self.rounds else 0.0,
+        }
+
+
+class ForwardCounter:
+    """
+    Counts calls to a model's top-level forward() made by the current thread while
+    active. The model is shared, so passes run by other requests' generations (which
+    also trigger the hook) are not counted.
+    """
+
+    def __init__(self, model):
+        # A PEFT wrapper delegates generate() to the wrapped model; hook that one
+        get_base_model = getattr(model, "get_base_model", None)
+        self.model = get_base_model() if get_base_model else model
+        self.calls = 0
+        self._handle = None
+        self._thread = None
+
+    def _hook(self, module, args, output):
+        if threading.get_ident() == self._thread:
+            self.calls += 1
+
+    def __enter__(self):
+        self._thread = threading.get_ident()
+        self._handle = self.model.register_forward_hook(self._hook)
+        return self
+
+    def __exit__(self, *exc):
+        self._handle.remove()
+
+
+def load_draft_model(name, model, tokenizer, **kwargs):
+    """Load a draft model and check it can assist `model` (same vocabulary)."""
+    draft_tokenizer = AutoTokenizer.from_pretrained(name, **kwargs)
+    if draft_tokenizer.get_vocab() != tokenizer.get_vocab():
+        raise ValueError(f"Draft model {name} does not share the target model's tokenizer.")
+
+    model_class = AutoModelForSeq2SeqLM if model.config.is_encoder_decoder else AutoModelForCausalLM
+    draft = model_class.from_pretrained(name, **kwargs)
+    draft.eval()
+    return draft
+
+
+def assisted_generate(model, draft_model, input_ids, num_draft_tokens=NUM_DRAFT_TOKENS, stats=None, **generate_kwargs):
+    """
+    Greedy generate() with `draft_model` proposing `num_draft_tokens` per round.
+    Beam search and batches larger than one are not supported by assisted decoding.
+    """
+    if input_ids.shape[0] != 1:
+        raise ValueError("Assisted generation only supports a batch size of 1.")
+
+    generate_kwargs.pop("num_beams", None)
+    generate_kwargs.pop("early_stopping", None)
+    generate_kwargs["do_sample"] = False
+
+    # A fixed number of proposals per round keeps the acceptance metric meaningful
+    draft_model.generation_config.num_assistant_tokens = num_draft_tokens
+    draft_model.generation_config.num_assistant_tokens_schedule = "constant"
+
+    with torch.no_grad(), ForwardCounter(model) as target_calls, ForwardCounter(draft_model) as draft_calls:
+        output = model.generate(input_ids=input_ids, assistant_model=draft_model, num_beams=1, **generate_kwargs)
+
+    if stats is not None:
+        prompt_length = 1 if model.config.is_encoder_decoder else input_ids.shape[1]
+        stats.add(target_calls.calls, draft_calls.calls, output.shape[1] - prompt_length)
+    return output
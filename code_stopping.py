@@ -0,0 +1,182 @@
+# code_stopping.py
+
+"""
+Syntax-aware early stopping for Python code generation.
+
+PythonStopCriteria is passed to generate() and, every few tokens, decodes
+what has been generated so far. It stops decoding as soon as the output is
+finished:
+- a Markdown code block has been opened and closed again,
+- an end pattern appears (the model starting a new "# Task:", or an EOS marker),
+- or the code is a syntactically complete unit: it parses with `ast`, `codeop`
+  says no more input is needed, it ends with a top-level compound statement
+  (def, class, for, ...) and that is followed by two blank lines. Imports or
+  simple statements followed by a blank line do not end generation.
+
+trim_code_output() then cuts the decoded text down to just the code. The
+number of decoding steps that were skipped is recorded per request; it is an
+upper bound, since without the early stop EOS might have come sooner.
+"""
+
+import ast
+import codeop
+import warnings
+import threading
+
+from transformers import StoppingCriteria
+
+FENCE = "```"
+END_MARKERS = ["\n# Task:", "<|endoftext|>"]
+CHECK_EVERY = 4          # decode and check every N new tokens
+MIN_NEW_TOKENS = 8       # never stop before this many tokens
+COMPOUND_STATEMENTS = (
+    ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.If, ast.For, ast.AsyncFor,
+    ast.While, ast.With, ast.AsyncWith, ast.Try,
+) + ((ast.Match,) if hasattr(ast, "Match") else ()) + ((ast.TryStar,) if hasattr(ast, "TryStar") else ())
+
+
+def _strip_fence_lines(text):
+    return "\n".join(line for line in text.splitlines() if not line.strip().startswith(FENCE))
+
+
+def _complete_unit_end(code):
+    """True if `code` is a finished unit ending in a top-level compound statement."""
+    code = _strip_fence_lines(code).strip("\n")
+    if not code.strip():
+        return False
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            tree = ast.parse(code)
+            if not tree.body or not isinstance(tree.body[-1], COMPOUND_STATEMENTS):
+                return False
+            return codeop.compile_command(code + "\n\n", "<generated>", "exec") is not None
+    except (SyntaxError, ValueError, OverflowError):
+        return False
+
+
+def find_completion(text):
+    """
+    Offset in `text` where the finished output ends (see module docstring), or None
+    if it is not finished yet. Anything after the offset is the start of unwanted output.
+    """
+    ends = [text.find(marker) for marker in END_MARKERS if marker in text]
+    if ends:
+        return min(ends)
+
+    offset = 0
+    fences = 0
+    for line in text.splitlines(keepends=True):
+        offset += len(line)
+        if line.strip().startswith(FENCE):
+            fences += 1
+            if fences == 2:
+                return offset
+
+    # Blank lines are common inside function bodies and after imports, so a unit is only
+    # complete after a top-level compound statement (def, class, for, ...) followed by
+    # two blank lines - the spacing PEP 8 puts after a top-level def/class. Checks run
+    # every few tokens, so the model may already have started the next statement: try
+    # each such boundary, latest first.
+    boundary = text.rfind("\n\n\n")
+    while boundary > 0:
+        if _complete_unit_end(text[:boundary]):
+            return boundary
+        boundary = text.rfind("\n\n\n", 0, boundary)
+    return None
+
+
+def is_complete_python(text):
+    """True if `text` is a finished piece of generated Python (see module docstring)."""
+    return find_completion(text) is not None
+
+
+def trim_code_output(text, stopped_early=False):
+    """
+    Cut generated text down to the code: drop end markers, anything after a closing
+    fence, and fence lines. With stopped_early=True (PythonStopCriteria ended decoding)
+    it also cuts at the completion point, dropping the start of the next statement.
+    """
+    for marker in END_MARKERS:
+        idx = text.find(marker)
+        if idx != -1:
+            text = text[:idx]
+    if stopped_early:
+        cut = find_completion(text)
+        if cut is not None:
+            text = text[:cut]
+
+    lines = text.splitlines()
+    fences = [i for i, line in enumerate(lines) if line.strip().startswith(FENCE)]
+    if len(fences) >= 2:
+        lines = lines[fences[0] + 1:fences[1]]
+    else:
+        lines = [line for line in lines if not line.strip().startswith(FENCE)]
+    return "\n".join(lines).strip()
+
+
+class StopStats:
+    def __init__(self):
+        self.requests = 0
+        self.early_stops = 0
+        self.tokens_generated = 0
+        self.tokens_saved = 0
+        self._lock = threading.Lock()
+
+    def add(self, generated, saved):
+        with self._lock:
+            self.requests += 1
+            self.tokens_generated += generated
+            self.tokens_saved += saved
+            if saved:
+                self.early_stops += 1
+
+    def as_dict(self):
+        budget = self.tokens_generated + self.tokens_saved
+        return {
+            "requests": self.requests,
+            "early_stops": self.early_stops,
+            "tokens_generated": self.tokens_generated,
+            # Upper bounds: generation might have hit EOS before max_length anyway
+            "tokens_saved_upper_bound": self.tokens_saved,
+            "saved_fraction_upper_bound": self.tokens_saved / budget if budget else 0.0,
+        }
+
+
+class PythonStopCriteria(StoppingCriteria):
+    """
+    Stops generation once every sequence in the batch (or every beam) is complete.
+    `prompt_length` is the number of leading ids that are not generated output
+    (1 for encoder-decoder models - the decoder start token - or the prompt length
+    for causal models); `max_length` is the length generate() would otherwise run to.
+    """
+
+    def __init__(self, tokenizer, prompt_length, max_length, check_every=CHECK_EVERY, min_new_tokens=MIN_NEW_TOKENS):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.max_length = max_length
+        self.check_every = check_every
+        self.min_new_tokens = min_new_tokens
+        self.stopped_at = None
+        self._last_checked = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        new_tokens = input_ids.shape[1] - self.prompt_length
+        # Assisted decoding can add several tokens per call, so count since the last check
+        if new_tokens < self.min_new_tokens or new_tokens - self._last_checked < self.check_every:
+            return False
+        self._last_checked = new_tokens
+
+        for row in input_ids:
+            text = self.tokenizer.decode(row[self.prompt_length:], skip_special_tokens=True)
+            if not is_complete_python(text):
+                return False
+
+        self.stopped_at = input_ids.shape[1]
+        return True
+
+    def tokens_saved(self):
+        """Decoding steps left before max_length when generation stopped - an upper bound."""
+        if self.stopped_at is None:
+            return 0
+        return max(self.max_length - self.stopped_at, 0)
@@ -0,0 +1,396 @@
+# corpus_store.py
+
+"""
+Compressed, sharded storage for the crawled corpus with a random-access index.
+
+A sharded corpus is a directory:
+    shard-00000.jsonl.gz     records, each compressed as its own gzip member
+    shard-00001.jsonl.gz     (or zstd frame, .jsonl.zst, if `zstandard` is installed)
+    ...
+    index.jsonl              {"row", "url", "shard", "offset", "length"} per record
+
+Shards are capped at `max_shard_bytes`. Because every record is an independent
+compressed frame, a lookup by row number or URL reads and decompresses exactly
+one record; a whole shard is still a valid .gz/.zst stream for sequential
+reads, and shards can be processed in parallel.
+
+Usage:
+    python corpus_store.py init DIR [--compression gzip|zstd]
+    python corpus_store.py convert SRC.jsonl DEST_DIR [--compression gzip|zstd]
+    python corpus_store.py get DIR (--row N | --url URL)
+    python corpus_store.py stats DIR
+"""
+
+import os
+import sys
+import glob
+import gzip
+import json
+import argparse
+from multiprocessing import Pool
+
+from dataset_writer import lock_file, unlock_file, recover_partial_lines
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+INDEX_FILE = "index.jsonl"
+MAX_SHARD_BYTES = 64 * 1024 * 1024
+EXTENSIONS = {"gzip": ".jsonl.gz", "zstd": ".jsonl.zst"}
+
+
+def is_sharded(path):
+    """
+    True if `path` is an existing sharded corpus directory. Anything else is a plain
+    JSONL file; a new sharded corpus is created explicitly (`init` or `convert`).
+    """
+    return os.path.isdir(path)
+
+
+def _compress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+
+def _decompress(data, compression):
+    if compression == "zstd":
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+
+def _compression_of(shard_name):
+    return "zstd" if shard_name.endswith(".zst") else "gzip"
+
+
+def _last_line(f):
+    """Last complete line of a file opened in binary mode, or None."""
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return None
+    pos = max(0, size - 64 * 1024)
+    f.seek(pos)
+    lines = f.read().splitlines()
+    return lines[-1] if lines else None
+
+
+class ShardedCorpusWriter:
+    """
+    Appends records to a sharded corpus. Offers the same submit/write/flush/truncate
+    interface as DatasetWriter so callers can write to either kind of corpus.
+    Appends hold an advisory lock on the index, so several processes can share a corpus.
+    """
+
+    def __init__(self, directory, compression=None, max_shard_bytes=MAX_SHARD_BYTES):
+        if compression is None:
+            compression = "zstd" if zstandard is not None else "gzip"
+        if compression == "zstd" and zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package (pip install zstandard).")
+        if compression not in EXTENSIONS:
+            raise ValueError(f"Unknown compression: {compression}")
+
+        self.directory = directory
+        self.compression = compression
+        self.max_shard_bytes = max_shard_bytes
+        os.makedirs(directory, exist_ok=True)
+        self._index = open(os.path.join(directory, INDEX_FILE), "a+b")
+
+        lock_file(self._index)
+        try:
+            recover_partial_lines(self._index)
+        finally:
+            unlock_file(self._index)
+
+    def submit(self, record):
+        self.write_many([record])
+
+    def write(self, record, timeout=None):
+        self.write_many([record])
+        return True
+
+    def write_many(self, records):
+        lock_file(self._index)
+        try:
+            row, shard_name, shard_size = self._tail()
+            entries = []
+            shard = None
+            try:
+                for record in records:
+                    frame = _compress((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"), self.compression)
+                    if shard_name is None or (shard_size and shard_size + len(frame) > self.max_shard_bytes):
+                        if shard is not None:
+                            shard.close()
+                        shard_name = self._next_shard_name()
+                        shard = None
+                    if shard is None:
+                        shard = open(os.path.join(self.directory, shard_name), "ab")
+                        shard_size = shard.seek(0, os.SEEK_END)
+
+                    shard.write(frame)
+                    entries.append({
+                        "row": row,
+                        "url": record.get("url"),
+                        "shard": shard_name,
+                        "offset": shard_size,
+                        "length": len(frame),
+                    })
+                    row += 1
+                    shard_size += len(frame)
+            finally:
+                if shard is not None:
+                    shard.flush()
+                    os.fsync(shard.fileno())
+                    shard.close()
+
+            # The index is written last: a crash before this point leaves only unindexed bytes
+            self._index.seek(0, os.SEEK_END)
+            self._index.write("".join(json.dumps(e, ensure_ascii=False) + "\n" for e in entries).encode("utf-8"))
+            self._index.flush()
+        finally:
+            unlock_file(self._index)
+
+    def flush(self, timeout=None):
+        os.fsync(self._index.fileno())
+
+    def truncate(self):
+        lock_file(self._index)
+        try:
+            for path in glob.glob(os.path.join(self.directory, "shard-*")):
+                os.remove(path)
+            self._index.truncate(0)
+            self._index.flush()
+        finally:
+            unlock_file(self._index)
+
+    def close(self):
+        self._index.close()
+
+    def _tail(self):
+        """(next row, current shard name, current shard size) from the end of the index."""
+        last = _last_line(self._index)
+        if last is None:
+            return 0, None, 0
+        entry = json.loads(last)
+        shard_name = entry["shard"]
+        if _compression_of(shard_name) != self.compression:
+            return entry["row"] + 1, None, 0  # never mix codecs inside one shard
+        shard_path = os.path.join(self.directory, shard_name)
+        size = os.path.getsize(shard_path) if os.path.exists(shard_path) else 0
+        return entry["row"] + 1, shard_name, size
+
+    def _next_shard_name(self):
+        existing = glob.glob(os.path.join(self.directory, "shard-*"))
+        numbers = [int(os.path.basename(p).split("-")[1].split(".")[0]) for p in existing]
+        number = max(numbers) + 1 if numbers else 0
+        return f"shard-{number:05d}{EXTENSIONS[self.compression]}"
+
+
+class CorpusReader:
+    def __init__(self, directory):
+        self.directory = directory
+        self._rows = None
+        self._by_url = None
+        self._by_shard = None
+
+    def _load_index(self):
+        if self._rows is not None:
+            return
+        self._rows = []
+        self._by_url = {}
+        self._by_shard = {}
+        path = os.path.join(self.directory, INDEX_FILE)
+        if not os.path.exists(path):
+            return
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                entry = json.loads(line)
+                self._rows.append(entry)
+                if entry.get("url"):
+                    self._by_url[entry["url"]] = entry
+                # Records are appended, so each shard's entries are already in offset order
+                self._by_shard.setdefault(entry["shard"], []).append(entry)
+
+    def __len__(self):
+        self._load_index()
+        return len(self._rows)
+
+    def urls(self):
+        self._load_index()
+        return set(self._by_url)
+
+    def get(self, row):
+        """Record number `row`, decompressing only that record."""
+        self._load_index()
+        return self._read(self._rows[row])
+
+    def get_by_url(self, url):
+        self._load_index()
+        entry = self._by_url.get(url)
+        return None if entry is None else self._read(entry)
+
+    def _read(self, entry):
+        with open(os.path.join(self.directory, entry["shard"]), "rb") as f:
+            f.seek(entry["offset"])
+            data = f.read(entry["length"])
+        return json.loads(_decompress(data, _compression_of(entry["shard"])))
+
+    def shard_entries(self, shard):
+        """Index entries of one shard (a path or file name), in offset order."""
+        self._load_index()
+        return self._by_shard.get(os.path.basename(shard), [])
+
+    def shards(self):
+        return sorted(glob.glob(os.path.join(self.directory, "shard-*")))
+
+    def iter_records(self):
+        """Stream every indexed record in row order, keeping one shard open at a time."""
+        self._load_index()
+        f = None
+        current = None
+        try:
+            for entry in self._rows:
+                if entry["shard"] != current:
+                    if f is not None:
+                        f.close()
+                    current = entry["shard"]
+                    f = open(os.path.join(self.directory, current), "rb")
+                f.seek(entry["offset"])
+                yield json.loads(_decompress(f.read(entry["length"]), _compression_of(current)))
+        finally:
+            if f is not None:
+                f.close()
+
+    def map_shards(self, fn, workers=None):
+        """
+        Apply fn(shard_path) to every shard in a process pool and return the results
+        in shard order. Use iter_shard() inside fn to stream a shard's records.
+        """
+        with Pool(processes=workers) as pool:
+            return pool.map(fn, self.shards())
+
+
+_readers = {}
+
+
+def _cached_reader(directory):
+    """
+    A CorpusReader per corpus directory, kept until index.jsonl changes, so reading
+    shard after shard (e.g. in a map_shards worker) parses the index only once.
+    """
+    directory = os.path.abspath(directory)
+    try:
+        stat = os.stat(os.path.join(directory, INDEX_FILE))
+        stamp = (stat.st_size, stat.st_mtime_ns)
+    except FileNotFoundError:
+        stamp = None
+    cached = _readers.get(directory)
+    if cached is None or cached[0] != stamp:
+        cached = (stamp, CorpusReader(directory))
+        _readers[directory] = cached
+    return cached[1]
+
+
+def iter_shard(path):
+    """
+    Stream the records of one shard file through the index. Bytes the index does not
+    cover (a partially written frame left by a crash) are skipped, and records
+    appended after them are still read.
+    """
+    entries = _cached_reader(os.path.dirname(path)).shard_entries(path)
+    compression = _compression_of(path)
+    with open(path, "rb") as f:
+        for entry in entries:
+            f.seek(entry["offset"])
+            yield json.loads(_decompress(f.read(entry["length"]), compression))
+
+
+def iter_corpus(path):
+    """Stream records from either a plain .jsonl file or a sharded corpus directory."""
+    if is_sharded(path):
+        yield from CorpusReader(path).iter_records()
+    else:
+        from dataset_reader import iter_jsonl
+        yield from iter_jsonl(path)
+
+
+def open_corpus_writer(path, **kwargs):
+    """A ShardedCorpusWriter for corpus directories, the shared DatasetWriter for .jsonl files."""
+    if is_sharded(path):
+        return ShardedCorpusWriter(path, **kwargs)
+    from dataset_writer import get_writer
+    return get_writer(path)
+
+
+def _shard_stats(path):
+    return os.path.getsize(path), sum(1 for _ in iter_shard(path))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded corpus tools.")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("init", help="Create an empty sharded corpus (e.g. as a crawl output).")
+    p.add_argument("directory")
+    p.add_argument("--compression", choices=sorted(EXTENSIONS), default=None)
+
+    p = sub.add_parser("convert", help="Convert a .jsonl corpus into a sharded, compressed one.")
+    p.add_argument("source")
+    p.add_argument("dest")
+    p.add_argument("--compression", choices=sorted(EXTENSIONS), default=None)
+    p.add_argument("--max-shard-mb", type=int, default=MAX_SHARD_BYTES // (1024 * 1024))
+
+    p = sub.add_parser("get", help="Print one record by row number or URL.")
+    p.add_argument("directory")
+    p.add_argument("--row", type=int)
+    p.add_argument("--url")
+
+    p = sub.add_parser("stats", help="Show shard sizes and record counts.")
+    p.add_argument("directory")
+    p.add_argument("--workers", type=int, default=None)
+
+    args = parser.parse_args()
+
+    if args.command == "init":
+        if os.path.exists(args.directory):
+            print(f"❌ {args.directory} already exists")
+            sys.exit(1)
+        ShardedCorpusWriter(args.directory, args.compression).close()
+        print(f"✅ Created sharded corpus {args.directory}")
+    elif args.command == "convert":
+        from dataset_reader import iter_jsonl
+
+        writer = ShardedCorpusWriter(args.dest, args.compression, args.max_shard_mb * 1024 * 1024)
+        batch = []
+        count = 0
+        for record in iter_jsonl(args.source):
+            batch.append(record)
+            if len(batch) >= 256:
+                writer.write_many(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            writer.write_many(batch)
+            count += len(batch)
+        writer.close()
+        src_size = os.path.getsize(args.source)
+        dest_size = sum(os.path.getsize(p) for p in glob.glob(os.path.join(args.dest, "*")))
+        print(f"✅ Converted {count} record(s): {src_size / 1e6:.1f} MB -> {dest_size / 1e6:.1f} MB")
+    elif args.command == "get":
+        reader = CorpusReader(args.directory)
+        record = reader.get(args.row) if args.row is not None else reader.get_by_url(args.url)
+        if record is None:
+            print("❌ Not found")
+            sys.exit(1)
+        print(json.dumps(record, ensure_ascii=False, indent=2))
+    elif args.command == "stats":
+        reader = CorpusReader(args.directory)
+        for shard, (size, count) in zip(reader.shards(), reader.map_shards(_shard_stats, args.workers)):
+            print(f"{os.path.basename(shard)}: {count} record(s), {size / 1e6:.1f} MB")
+        print(f"📦 {len(reader)} indexed record(s)")
+    else:
+        parser.print_help()
+        sys.exit(1)
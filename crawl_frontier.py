@@ -0,0 +1,94 @@
+# crawl_frontier.py
+
+"""
+Cheap relevance signals for focused crawling.
+
+Links are scored before they are fetched, from their URL, their anchor text
+and how code-heavy the page linking to them was. The scheduler fetches the
+highest-scoring links first, so a small max_pages budget goes to tutorial and
+example pages rather than navigation, tag and category listings.
+"""
+
+import re
+from urllib.parse import urlparse
+
+GOOD_URL_PATTERNS = [
+    (re.compile(r"python", re.I), 2.0),
+    (re.compile(r"tutorial|guide|how-?to|example|snippet|recipe|cookbook", re.I), 1.5),
+    (re.compile(r"/(docs?|library|reference|howto)/", re.I), 1.0),
+    (re.compile(r"code|function|class|module|script", re.I), 0.5),
+]
+
+BAD_URL_PATTERNS = [
+    (re.compile(r"/(tag|tags|category|categories|topics?|archive|author|authors|user|users|profile)/", re.I), -2.0),
+    (re.compile(r"/(login|signin|signup|register|account|cart|checkout|subscribe|newsletter)\b", re.I), -3.0),
+    (re.compile(r"/(about|contact|privacy|terms|legal|careers|jobs|advertise|press)\b", re.I), -2.5),
+    (re.compile(r"/page/\d+|[?&](page|p|sort|filter|ref|utm_[a-z]+)=", re.I), -1.5),
+    (re.compile(r"/(search|feed|rss|print)\b", re.I), -2.0),
+]
+
+GOOD_ANCHOR_WORDS = {
+    "python", "example", "examples", "tutorial", "how", "code", "function", "functions",
+    "class", "classes", "module", "script", "implement", "write", "using", "guide", "program",
+}
+
+BAD_ANCHOR_WORDS = {
+    "home", "login", "sign", "register", "next", "previous", "prev", "more", "privacy",
+    "terms", "contact", "about", "careers", "advertise", "subscribe", "categories", "tags",
+}
+
+_WORD = re.compile(r"[a-z]+")
+
+# A link inherits up to this much score from a code-dense parent page
+PARENT_WEIGHT = 3.0
+
+
+def code_density(soup, text_length=None):
+    """
+    Share of a page's text that sits inside <pre>/<code> blocks, blended with
+    how many such blocks there are. Returns a value in [0, 1].
+    """
+    blocks = soup.find_all(["pre", "code"])
+    if not blocks:
+        return 0.0
+    if text_length is None:
+        text_length = len(soup.get_text())
+    # <code> inside <pre> would be counted twice; only count outermost blocks
+    outer = [b for b in blocks if b.find_parent(["pre", "code"]) is None]
+    code_chars = sum(len(b.get_text()) for b in outer)
+    share = min(code_chars / max(text_length, 1), 1.0)
+    count_signal = min(len(outer) / 10.0, 1.0)
+    return 0.5 * share + 0.5 * count_signal
+
+
+def is_code_rich(soup):
+    """A page is useful for the Python corpus if it has at least one multi-line code block."""
+    return any("\n" in pre.get_text().strip() for pre in soup.find_all("pre"))
+
+
+def score_url(url):
+    path = urlparse(url)
+    target = f"{path.path}?{path.query}" if path.query else path.path
+    score = 0.0
+    for pattern, weight in GOOD_URL_PATTERNS + BAD_URL_PATTERNS:
+        if pattern.search(target):
+            score += weight
+    # Very shallow paths are usually section landing pages
+    if target.strip("/").count("/") == 0:
+        score -= 0.5
+    return score
+
+
+def score_anchor(text):
+    words = set(_WORD.findall((text or "").lower()))
+    if not words:
+        return -0.5
+    score = 0.5 * len(words & GOOD_ANCHOR_WORDS) - 1.0 * len(words & BAD_ANCHOR_WORDS)
+    # Descriptive anchors ("How to read a CSV file in Python") beat one-word nav links
+    if len(words) >= 4:
+        score += 0.5
+    return score
+
+
+def score_link(url, anchor_text="", parent_density=0.0):
+    return score_url(url) + score_anchor(anchor_text) + PARENT_WEIGHT * parent_density
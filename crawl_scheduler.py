@@ -0,0 +1,256 @@
+# crawl_scheduler.py
+
+"""
+Per-host politeness scheduling for the crawler.
+
+Each host gets its own priority queue and token bucket. Among the hosts that
+are ready, the scheduler hands out the highest-priority URL; it only sleeps
+when every host with pending work is rate-limited, so hosts are interleaved
+and the crawl is best-first within each politeness constraint.
+
+Politeness rules:
+- robots.txt is fetched once per host; disallowed URLs are never queued and a
+  Crawl-delay / Request-rate lowers that host's rate.
+- A 429 or 5xx (or a connection error) halves the host's rate and pauses the
+  host for Retry-After seconds, or an exponential backoff with jitter; either
+  way the pause is capped at MAX_BACKOFF. The URL is retried up to
+  `max_retries` times.
+- Every successful fetch nudges the rate back up towards the default.
+
+The HTTP session, clock and sleep function can be injected, so the scheduler
+can be exercised against a local server that returns throttling responses.
+"""
+
+import time
+import heapq
+import random
+import itertools
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+from urllib.robotparser import RobotFileParser
+
+import requests
+
+USER_AGENT = "PyThorCrawler/1.0 (+https://github.com/xmione/pythor)"
+DEFAULT_RATE = 1.0          # requests per second per host
+MIN_RATE = 0.05
+RATE_RECOVERY = 0.1         # requests/second regained per successful fetch
+BASE_BACKOFF = 1.0          # seconds
+MAX_BACKOFF = 120.0
+MAX_RETRIES = 3
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def parse_retry_after(value, now=None):
+    """Return the delay in seconds described by a Retry-After header, or None."""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    now = time.time() if now is None else now
+    return max(when.timestamp() - now, 0.0)
+
+
+class TokenBucket:
+    def __init__(self, rate, capacity=1.0, now=0.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+
+    def _refill(self, now):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def ready_at(self, now):
+        """Earliest time at which a token will be available."""
+        self._refill(now)
+        if self.tokens >= 1.0:
+            return now
+        return now + (1.0 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1.0
+
+
+class HostState:
+    def __init__(self, host, rate, now):
+        self.host = host
+        self.max_rate = rate
+        self.bucket = TokenBucket(rate, now=now)
+        self.queue = []             # heap of (-priority, seq, url, depth, attempt)
+        self.robots = None
+        self.paused_until = 0.0
+        self.failures = 0
+
+    def ready_at(self, now):
+        return max(self.bucket.ready_at(now), self.paused_until)
+
+    def set_rate(self, rate):
+        self.bucket.rate = max(MIN_RATE, min(rate, self.max_rate))
+
+
+class PoliteScheduler:
+    def __init__(
+        self,
+        session=None,
+        user_agent=USER_AGENT,
+        rate=DEFAULT_RATE,
+        max_retries=MAX_RETRIES,
+        respect_robots=True,
+        timeout=10,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.session = session or requests.Session()
+        self.session.headers.setdefault("User-Agent", user_agent)
+        self.user_agent = user_agent
+        self.rate = rate
+        self.max_retries = max_retries
+        self.respect_robots = respect_robots
+        self.timeout = timeout
+        self.clock = clock
+        self.sleep = sleep
+        self.hosts = {}
+        self.seen = set()
+        self._seq = itertools.count()
+        self.stats = {"fetched": 0, "throttled": 0, "retried": 0, "gave_up": 0, "robots_blocked": 0}
+
+    # --- Queueing ---
+
+    def add(self, url, depth=0, priority=0.0):
+        """Queue a URL unless it was queued before or robots.txt disallows it."""
+        if url in self.seen:
+            return False
+        self.seen.add(url)
+
+        host = self._host(url)
+        if self.respect_robots and not self._allowed(host, url):
+            self.stats["robots_blocked"] += 1
+            return False
+
+        self._push(host, url, depth, 0, priority)
+        return True
+
+    def _push(self, host, url, depth, attempt, priority):
+        heapq.heappush(host.queue, (-priority, next(self._seq), url, depth, attempt))
+
+    def pending(self):
+        return sum(len(h.queue) for h in self.hosts.values())
+
+    def next(self):
+        """
+        Return (url, depth, attempt, priority) with the highest priority among hosts that are
+        ready now. If no host is ready, sleep until the first one is. Returns None
+        when nothing is left.
+        """
+        candidates = [h for h in self.hosts.values() if h.queue]
+        if not candidates:
+            return None
+
+        now = self.clock()
+        ready = [h for h in candidates if h.ready_at(now) <= now]
+        if ready:
+            host = min(ready, key=lambda h: h.queue[0][:2])
+        else:
+            host = min(candidates, key=lambda h: h.ready_at(now))
+            self.sleep(host.ready_at(now) - now)
+            now = self.clock()
+
+        host.bucket.take(now)
+        neg_priority, _, url, depth, attempt = heapq.heappop(host.queue)
+        return url, depth, attempt, -neg_priority
+
+    # --- Fetching ---
+
+    def fetch(self, url, depth=0, attempt=0, priority=0.0):
+        """
+        GET a URL handed out by next(). Throttling responses and connection errors
+        slow the host down and re-queue the URL; returns the response, or None if
+        the request has to be retried later or was given up on.
+        """
+        host = self._host(url)
+        try:
+            resp = self.session.get(url, timeout=self.timeout)
+        except requests.RequestException as e:
+            print(f"⚠️ {url}: {e}")
+            self._throttle(host, None)
+            return self._retry(host, url, depth, attempt, priority)
+
+        self.stats["fetched"] += 1
+        if resp.status_code in RETRY_STATUSES:
+            self.stats["throttled"] += 1
+            print(f"🐢 {resp.status_code} from {host.host}; slowing down")
+            self._throttle(host, parse_retry_after(resp.headers.get("Retry-After")))
+            return self._retry(host, url, depth, attempt, priority)
+
+        host.failures = 0
+        host.set_rate(host.bucket.rate + RATE_RECOVERY)
+        return resp
+
+    def _throttle(self, host, retry_after):
+        host.failures += 1
+        host.set_rate(host.bucket.rate / 2)
+        if retry_after is None:
+            backoff = min(MAX_BACKOFF, BASE_BACKOFF * 2 ** (host.failures - 1))
+            retry_after = random.uniform(backoff / 2, backoff)  # jitter
+        # The crawl runs inside a web request; never let a server park it for hours
+        retry_after = min(retry_after, MAX_BACKOFF)
+        host.paused_until = max(host.paused_until, self.clock() + retry_after)
+
+    def _retry(self, host, url, depth, attempt, priority):
+        if attempt < self.max_retries:
+            self.stats["retried"] += 1
+            self._push(host, url, depth, attempt + 1, priority)
+        else:
+            self.stats["gave_up"] += 1
+            print(f"❌ Giving up on {url} after {attempt + 1} attempt(s)")
+        return None
+
+    # --- Hosts and robots.txt ---
+
+    def _host_key(self, url):
+        parsed = urlparse(url)
+        return f"{parsed.scheme}://{parsed.netloc}"
+
+    def _host(self, url):
+        key = self._host_key(url)
+        host = self.hosts.get(key)
+        if host is None:
+            host = HostState(key, self.rate, self.clock())
+            self.hosts[key] = host
+        return host
+
+    def _allowed(self, host, url):
+        if host.robots is None:
+            host.robots = self._load_robots(host)
+        return host.robots.can_fetch(self.user_agent, url)
+
+    def _load_robots(self, host):
+        robots = RobotFileParser()
+        try:
+            resp = self.session.get(f"{host.host}/robots.txt", timeout=self.timeout)
+            if resp.status_code == 200:
+                robots.parse(resp.text.splitlines())
+            else:
+                robots.parse([])  # missing or unreadable robots.txt: everything allowed
+        except requests.RequestException:
+            robots.parse([])
+
+        delay = robots.crawl_delay(self.user_agent)
+        request_rate = robots.request_rate(self.user_agent)
+        rate = self.rate
+        if delay:
+            rate = min(rate, 1.0 / float(delay))
+        if request_rate and request_rate.requests:
+            rate = min(rate, request_rate.requests / request_rate.seconds)
+        host.max_rate = rate
+        host.set_rate(rate)
+        return robots
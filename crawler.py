@@ -1,65 +1,87 @@
 import os
 import json
-import requests
 from bs4 import BeautifulSoup
 from urllib.parse import urljoin, urlparse
 
+from crawl_frontier import code_density, is_code_rich, score_link, score_url
+from crawl_scheduler import PoliteScheduler
+from corpus_store import CorpusReader, is_sharded, open_corpus_writer
+from page_archive import PageArchive
+
 DISALLOWED_EXTENSIONS = {
     ".pdf", ".jpg", ".jpeg", ".png", ".gif", ".svg",
     ".zip", ".tar", ".gz", ".rar", ".exe", ".dmg",
     ".mp4", ".avi", ".mov", ".mp3", ".wav"
 }
 
+STRIP_TAGS = ["script", "style", "noscript"]
+MIN_CONTENT_CHARS = 200
+
 def crawl_and_save(
     start_urls,
     output_file="./datasets/web_corpus.jsonl",
     max_pages=10,
     allowed_domains=None,
     append=True,
-    max_depth=2
+    max_depth=2,
+    scheduler=None,
+    archive_file=None
 ):
+    """
+    Best-first crawl: links are queued with a relevance score (URL, anchor text and
+    code density of the linking page) and the scheduler fetches the best ones first.
+    With `archive_file` set, every HTML response is also stored raw in a compressed
+    archive so page_archive.py can re-extract the corpus without re-fetching.
+    """
     saved = 0
-    visited = set()
-    file_mode = "a" if append else "w"
+    useful = 0
     crawled = set()
+    # An existing sharded corpus directory (see corpus_store.py init) gets compressed shards;
+    # any other path is appended to as one JSONL file
+    writer = open_corpus_writer(output_file)
+    # Per-host queues, rate limits, robots.txt and backoff live in the scheduler
+    scheduler = scheduler or PoliteScheduler()
+    archive = PageArchive(archive_file) if archive_file else None
 
     if append:
         crawled = load_existing_urls(output_file)
-
-    # queue will contain tuples of (url, depth)
-    queue = [(url, 0) for url in dict.fromkeys(start_urls)]
-
-    with open(output_file, file_mode, encoding="utf-8") as f_out:
-        while queue:
-            if saved >= max_pages:
+    else:
+        writer.truncate()
+
+    for url in dict.fromkeys(start_urls):
+        url = url.split("#")[0].rstrip("/")
+        if url not in crawled and not has_disallowed_extension(url):
+            scheduler.add(url, 0, priority=score_url(url))
+
+    try:
+        while saved < max_pages:
+            item = scheduler.next()
+            if item is None:
                 break
 
-            url, depth = queue.pop(0)
-            url = url.split("#")[0].rstrip("/")
-
-            if url in visited or url in crawled or has_disallowed_extension(url):
-                continue
-
-            visited.add(url)
+            url, depth, attempt, priority = item
 
             try:
-                resp = requests.get(url, timeout=10)
+                resp = scheduler.fetch(url, depth, attempt, priority)
+                if resp is None:
+                    continue
                 if resp.status_code != 200 or "text/html" not in resp.headers.get("Content-Type", ""):
                     continue
 
-                soup = BeautifulSoup(resp.text, "html.parser")
-                for tag in soup(["script", "style", "noscript"]):
-                    tag.decompose()
+                if archive:
+                    archive.add(url, resp)
 
-                content = soup.get_text(separator="\n", strip=True)
-
-                if not content or len(content) < 200:
+                soup, content = extract_content(resp.text)
+                if content is None:
                     continue
+                density = code_density(soup, len(content))
 
-                f_out.write(json.dumps({"url": url, "content": content}, ensure_ascii=False) + "\n")
+                writer.submit({"url": url, "content": content})
                 saved += 1
                 crawled.add(url)
-                print(f"✅ Saved: {url}")
+                if is_code_rich(soup):
+                    useful += 1
+                print(f"✅ Saved: {url} (score={priority:.1f}, code density={density:.2f})")
 
                 # Expand links (if depth limit not exceeded)
                 if depth < max_depth:
@@ -69,23 +91,46 @@ def crawl_and_save(
 
                         if (
                             not has_disallowed_extension(full_url)
-                            and full_url not in visited
                             and full_url not in crawled
                             and (
                                 allowed_domains is None
                                 or any(allowed in domain for allowed in allowed_domains)
                             )
                         ):
-                            queue.append((full_url, depth + 1))
+                            score = score_link(full_url, tag.get_text(" ", strip=True), density)
+                            scheduler.add(full_url, depth + 1, priority=score)
 
             except Exception as e:
                 print(f"❌ Error on {url}: {e}")
-
-        print(f"\n✅ Done. Saved {saved} new page(s) to {output_file}")
+    finally:
+        writer.flush()
+        if archive:
+            archive.close()
+
+    stats = scheduler.stats
+    print(f"\n✅ Done. Saved {saved} new page(s) to {output_file}")
+    if stats["fetched"]:
+        print(f"🎯 {useful} code-rich page(s) saved from {stats['fetched']} fetch(es) "
+              f"({useful / stats['fetched']:.2f} useful pages per fetch)")
+    print(f"📈 {stats['fetched']} fetch(es), {stats['throttled']} throttled, {stats['retried']} retried, "
+          f"{stats['gave_up']} given up, {stats['robots_blocked']} blocked by robots.txt")
+
+def extract_content(html):
+    """Parse a page and return (soup, text); text is None if the page is too short to keep."""
+    soup = BeautifulSoup(html, "html.parser")
+    for tag in soup(STRIP_TAGS):
+        tag.decompose()
+
+    content = soup.get_text(separator="\n", strip=True)
+    if not content or len(content) < MIN_CONTENT_CHARS:
+        return soup, None
+    return soup, content
 
 def load_existing_urls(output_file):
     if not os.path.exists(output_file):
         return set()
+    if is_sharded(output_file):
+        return CorpusReader(output_file).urls()  # index only, no decompression
     with open(output_file, "r", encoding="utf-8") as f:
         return {
             item["url"]
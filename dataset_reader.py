@@ -0,0 +1,71 @@
+# dataset_reader.py
+
+"""
+Streaming readers for the JSONL datasets.
+
+Records are yielded one at a time so callers never hold a whole corpus in
+memory. If `orjson` is installed it is used for parsing (it is several times
+faster than the standard library); otherwise we fall back to `json`.
+"""
+
+import json
+
+try:
+    import orjson
+
+    def parse_json(line):
+        return orjson.loads(line)
+
+    JSON_ERRORS = (orjson.JSONDecodeError, UnicodeDecodeError)
+except ImportError:
+    def parse_json(line):
+        return json.loads(line)
+
+    JSON_ERRORS = (json.JSONDecodeError, UnicodeDecodeError)
+
+READ_BUFFER_SIZE = 1024 * 1024
+
+
+def iter_jsonl(path):
+    """Yield every JSON object in a JSONL file, skipping blank and malformed lines."""
+    with open(path, "rb", buffering=READ_BUFFER_SIZE) as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = parse_json(line)
+            except JSON_ERRORS:
+                continue
+            if isinstance(item, dict):
+                yield item
+
+
+def iter_field(path, field):
+    """Yield the value of `field` from every record that has it."""
+    for item in iter_jsonl(path):
+        if field in item:
+            yield item[field]
+
+
+def instruction_pair(item):
+    """The {"input", "output"} training example for one dataset record, or None if it has none."""
+    if not isinstance(item, dict):
+        return None
+    instruction = item.get("instruction")
+    code = item.get("code")
+    if not isinstance(instruction, str) or not isinstance(code, str):
+        return None
+    instruction = instruction.strip()
+    code = code.strip()
+    if instruction and code:
+        return {"input": instruction, "output": code}
+    return None
+
+
+def iter_instruction_pairs(path):
+    """Yield {"input", "output"} training examples from an instruction/code dataset."""
+    for item in iter_jsonl(path):
+        example = instruction_pair(item)
+        if example is not None:
+            yield example
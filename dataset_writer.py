@@ -0,0 +1,272 @@
+# dataset_writer.py
+
+"""
+Single-writer service for the JSONL datasets.
+
+Every dataset file gets one DatasetWriter (see get_writer). Records are put on
+a queue and a background thread appends them at once - a batch is whatever
+queued up while the previous write was in progress - holding an advisory
+file lock for the duration of each batch so that lines written by several
+Flask worker processes never interleave. Durability is configurable: the file
+is fsync'ed every `fsync_every` records or every `fsync_interval_ms`
+milliseconds, whichever comes first.
+
+When a writer opens a file it first truncates any partial trailing line left
+behind by a crash, so the file always stays valid JSONL.
+"""
+
+import os
+import json
+import time
+import queue
+import atexit
+import threading
+from concurrent.futures import Future
+
+if os.name == "nt":
+    import msvcrt
+else:
+    import fcntl
+
+BATCH_SIZE = 64
+FSYNC_EVERY = 32
+FSYNC_INTERVAL_MS = 1000
+
+_STOP = object()
+
+
+def lock_file(f):
+    """Take an exclusive advisory lock on an open file (blocks until acquired)."""
+    if os.name == "nt":
+        f.seek(0)
+        while True:
+            try:
+                msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+                return
+            except OSError:
+                continue
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+
+
+def unlock_file(f):
+    if os.name == "nt":
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def recover_partial_lines(f):
+    """
+    Truncate a partial trailing line (no terminating newline) from a file
+    opened in binary read/write mode. A trailing line that is a complete JSON
+    record (e.g. a hand-edited file) is kept and gets its newline instead.
+    Returns the number of bytes removed. The caller must hold the file lock.
+    """
+    size = f.seek(0, os.SEEK_END)
+    if size == 0:
+        return 0
+
+    f.seek(size - 1)
+    if f.read(1) == b"\n":
+        return 0
+
+    # Walk backwards in blocks until the last newline is found
+    block = 64 * 1024
+    pos = size
+    keep = 0
+    while pos > 0:
+        start = max(0, pos - block)
+        f.seek(start)
+        chunk = f.read(pos - start)
+        idx = chunk.rfind(b"\n")
+        if idx != -1:
+            keep = start + idx + 1
+            break
+        pos = start
+
+    f.seek(keep)
+    try:
+        json.loads(f.read(size - keep).decode("utf-8"))
+        complete = True
+    except (ValueError, UnicodeDecodeError):
+        complete = False
+    if complete:
+        f.seek(0, os.SEEK_END)
+        f.write(b"\n")
+        f.flush()
+        os.fsync(f.fileno())
+        return 0
+
+    f.truncate(keep)
+    f.flush()
+    os.fsync(f.fileno())
+    return size - keep
+
+
+class DatasetWriter:
+    def __init__(
+        self,
+        path,
+        batch_size=BATCH_SIZE,
+        fsync_every=FSYNC_EVERY,
+        fsync_interval_ms=FSYNC_INTERVAL_MS,
+    ):
+        self.path = os.path.abspath(path)
+        self.batch_size = batch_size
+        self.fsync_every = fsync_every
+        self.fsync_interval = None if fsync_interval_ms is None else fsync_interval_ms / 1000.0
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, "a+b")
+        self._queue = queue.Queue()
+        self._unsynced = 0
+        self._last_fsync = time.monotonic()
+        self._closed = False
+
+        lock_file(self._file)
+        try:
+            removed = recover_partial_lines(self._file)
+        finally:
+            unlock_file(self._file)
+        if removed:
+            print(f"⚠️ Truncated {removed} byte(s) of partial trailing line in {self.path}")
+
+        self._thread = threading.Thread(target=self._run, name=f"DatasetWriter({os.path.basename(path)})", daemon=True)
+        self._thread.start()
+
+    def submit(self, record) -> Future:
+        """Queue a record for writing. The returned future resolves once it is written."""
+        if self._closed:
+            raise RuntimeError(f"DatasetWriter for {self.path} is closed")
+        future = Future()
+        line = (json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8")
+        self._queue.put((line, future))
+        return future
+
+    def write(self, record, timeout=None):
+        """Write a record and wait until it has been appended to the file."""
+        return self.submit(record).result(timeout)
+
+    def flush(self, timeout=None):
+        """Wait for everything queued so far to be written and fsync'ed."""
+        future = Future()
+        self._queue.put((None, future))
+        future.result(timeout)
+
+    def truncate(self):
+        """Empty the dataset file (used when a caller asks for a fresh, non-append write)."""
+        future = Future()
+        self._queue.put(("truncate", future))
+        future.result()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put((_STOP, None))
+        self._thread.join()
+        self._file.close()
+
+    def _run(self):
+        while True:
+            try:
+                # While data is waiting for an fsync, wake up in time to honour the interval
+                timeout = self.fsync_interval if self._unsynced and self.fsync_interval is not None else None
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                self._write_batch([])
+                continue
+
+            batch = [item]
+
+            # Write right away, taking along any records that are already queued
+            # (control items - flush, truncate, stop - always end a batch)
+            while len(batch) < self.batch_size and isinstance(batch[-1][0], bytes):
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            stop = self._write_batch(batch)
+            if stop:
+                return
+
+    def _write_batch(self, batch):
+        lines = []
+        waiters = []
+        control = []
+        stop = False
+
+        for line, future in batch:
+            if line is _STOP:
+                stop = True
+            elif line is None or line == "truncate":
+                control.append((line, future))
+            else:
+                lines.append(line)
+                waiters.append(future)
+
+        try:
+            lock_file(self._file)
+            try:
+                if lines:
+                    self._file.seek(0, os.SEEK_END)
+                    self._file.write(b"".join(lines))
+                    self._file.flush()
+                    self._unsynced += len(lines)
+                if any(line == "truncate" for line, _ in control):
+                    self._file.truncate(0)
+                    self._unsynced += 1
+
+                force = stop or bool(control)
+                if self._unsynced and (force or self._fsync_due()):
+                    os.fsync(self._file.fileno())
+                    self._unsynced = 0
+                    self._last_fsync = time.monotonic()
+            finally:
+                unlock_file(self._file)
+        except Exception as e:
+            for future in waiters:
+                future.set_exception(e)
+            for _, future in control:
+                future.set_exception(e)
+            return stop
+
+        for future in waiters:
+            future.set_result(True)
+        for _, future in control:
+            future.set_result(True)
+        return stop
+
+    def _fsync_due(self):
+        if self.fsync_every and self._unsynced >= self.fsync_every:
+            return True
+        if self.fsync_interval is not None and time.monotonic() - self._last_fsync >= self.fsync_interval:
+            return True
+        return False
+
+
+_writers = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path, **kwargs) -> DatasetWriter:
+    """Return the process-wide writer for a dataset file, creating it on first use."""
+    key = os.path.abspath(path)
+    with _writers_lock:
+        writer = _writers.get(key)
+        if writer is None:
+            writer = DatasetWriter(path, **kwargs)
+            _writers[key] = writer
+        return writer
+
+
+@atexit.register
+def close_all():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
@@ -0,0 +1,214 @@
+# page_archive.py
+
+"""
+Compressed archive of raw crawler responses, so that text extraction can be
+re-run without going back to the network.
+
+Each archived response is one WARC-like JSON record
+    {"url", "status", "headers", "fetched_at", "encoding", "body"}
+compressed as its own gzip member and appended to the archive file (a file of
+concatenated gzip members is itself a valid .gz file). A crash can leave a
+damaged last member; opening the archive for writing truncates it, so later
+records are appended after the last complete one. The end of the last complete
+member is kept in a sidecar file (<archive>.offset) so that only bytes written
+after it have to be checked.
+
+Usage:
+    python page_archive.py reextract [--archive PATH] [--output PATH] [--workers N] [--force]
+"""
+
+import os
+import sys
+import gzip
+import json
+import time
+import zlib
+import argparse
+import threading
+from multiprocessing import Pool
+
+from corpus_store import open_corpus_writer
+from dataset_writer import lock_file, unlock_file
+
+ARCHIVE_FILE = "./datasets/web_archive.jsonl.gz"
+# Not the live ./datasets/web_corpus.jsonl: it also holds pages that were never archived
+REEXTRACT_OUTPUT = "./datasets/reextracted/web_corpus.jsonl"
+COMPRESS_LEVEL = 6
+
+
+def read_good_offset(path):
+    """End of the last complete member according to the sidecar file, or 0 if unknown."""
+    try:
+        with open(path + ".offset", "r", encoding="utf-8") as f:
+            return int(f.read().strip() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def write_good_offset(path, offset):
+    tmp = path + ".offset.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(str(offset))
+    os.replace(tmp, path + ".offset")
+
+
+def recover_damaged_tail(f, start=0):
+    """
+    Truncate an incomplete gzip member left at the end of the archive by a crash,
+    checking only the members from `start` (a known member boundary) on.
+    The caller must hold the file lock. Returns (bytes removed, new size).
+    """
+    f.seek(0, os.SEEK_END)
+    size = f.tell()
+    if start > size:
+        start = 0  # sidecar is stale (archive replaced or truncated)
+    f.seek(start)
+
+    good = pos = start
+    decomp = zlib.decompressobj(wbits=31)
+    try:
+        while True:
+            chunk = f.read(1 << 20)
+            if not chunk:
+                break
+            while chunk:
+                decomp.decompress(chunk)
+                if not decomp.eof:
+                    pos += len(chunk)
+                    break
+                # End of a member: anything left over starts the next one
+                pos += len(chunk) - len(decomp.unused_data)
+                good = pos
+                chunk = decomp.unused_data
+                decomp = zlib.decompressobj(wbits=31)
+    except zlib.error:
+        pass
+
+    if good == size:
+        return 0, size
+    f.truncate(good)
+    f.flush()
+    os.fsync(f.fileno())
+    return size - good, good
+
+
+class PageArchive:
+    def __init__(self, path=ARCHIVE_FILE, compresslevel=COMPRESS_LEVEL):
+        self.path = path
+        self.compresslevel = compresslevel
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._file = open(path, "a+b")
+        self._lock = threading.Lock()
+
+        lock_file(self._file)
+        try:
+            removed, size = recover_damaged_tail(self._file, read_good_offset(path))
+            write_good_offset(path, size)
+        finally:
+            unlock_file(self._file)
+        if removed:
+            print(f"⚠️ Truncated {removed} byte(s) of damaged archive tail in {path}")
+
+    def add(self, url, resp):
+        """Archive a requests.Response."""
+        record = {
+            "url": url,
+            "status": resp.status_code,
+            "headers": dict(resp.headers),
+            "fetched_at": time.time(),
+            "encoding": resp.encoding,
+            "body": resp.text,
+        }
+        data = gzip.compress((json.dumps(record, ensure_ascii=False) + "\n").encode("utf-8"), self.compresslevel)
+        with self._lock:
+            lock_file(self._file)
+            try:
+                self._file.seek(0, os.SEEK_END)
+                self._file.write(data)
+                self._file.flush()
+                write_good_offset(self.path, self._file.tell())
+            finally:
+                unlock_file(self._file)
+
+    def close(self):
+        self._file.close()
+
+
+def iter_archive(path=ARCHIVE_FILE):
+    """Yield archived records in the order they were fetched, stopping at a damaged tail."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        try:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            print(f"⚠️ Stopped at damaged archive tail in {path}: {e}")
+
+
+def _extract(record):
+    from crawler import extract_content
+
+    # Headers are stored with the server's key case
+    headers = {key.lower(): value for key, value in record.get("headers", {}).items()}
+    if record.get("status") != 200 or "text/html" not in headers.get("content-type", ""):
+        return None
+    _, content = extract_content(record["body"])
+    if content is None:
+        return None
+    return {"url": record["url"], "content": content}
+
+
+def reextract(archive_file=ARCHIVE_FILE, output_file=REEXTRACT_OUTPUT, workers=None, force=False):
+    """
+    Rebuild a text corpus from the archive using the current extraction logic. No network
+    access. The output only holds archived pages, so an existing output is only
+    overwritten with force=True.
+    """
+    if not os.path.exists(archive_file):
+        print(f"❌ Archive not found: {archive_file}")
+        return 0
+    if os.path.exists(output_file) and not force:
+        print(f"❌ {output_file} already exists; pages that were never archived would be lost. "
+              f"Use --force to overwrite it.")
+        return 0
+
+    start = time.perf_counter()
+    seen = set()
+
+    def unique_records():
+        for record in iter_archive(archive_file):
+            if record["url"] not in seen:
+                seen.add(record["url"])
+                yield record
+
+    writer = open_corpus_writer(output_file)
+    writer.truncate()
+    saved = 0
+    with Pool(processes=workers) as pool:
+        for item in pool.imap(_extract, unique_records(), chunksize=16):
+            if item is not None:
+                writer.submit(item)
+                saved += 1
+    writer.flush()
+
+    elapsed = time.perf_counter() - start
+    print(f"✅ Re-extracted {saved} page(s) from {len(seen)} archived response(s) "
+          f"into {output_file} in {elapsed:.1f}s")
+    return saved
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Raw crawl archive tools.")
+    sub = parser.add_subparsers(dest="command")
+    p = sub.add_parser("reextract", help="Rebuild the corpus from the archive without re-fetching.")
+    p.add_argument("--archive", default=ARCHIVE_FILE)
+    p.add_argument("--output", default=REEXTRACT_OUTPUT)
+    p.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    p.add_argument("--force", action="store_true", help="Overwrite an existing output corpus.")
+    args = parser.parse_args()
+
+    if args.command != "reextract":
+        parser.print_help()
+        sys.exit(1)
+
+    reextract(args.archive, args.output, args.workers, force=args.force)
@@ -1,13 +1,435 @@
+# prepare_dataset.py
+
+"""
+Builds the fine-tuning corpus from every JSONL source in ./datasets, plus any
+sharded corpus directories (see corpus_store.py).
+
+Pipeline stages:
+  1. read       - split each source into line-aligned chunks
+  2. process    - (in parallel, one chunk per task) normalise, filter by
+                  length and language, hash and MinHash each record
+  3. dedup      - drop exact duplicates (SHA-256 of the normalised text)
+  4. near-dup   - drop near duplicates (MinHash + LSH, Jaccard >= threshold)
+  5. shard      - write the surviving records to size-capped text shards
+
+The process stage is incremental: its output is cached per chunk, keyed by the
+hash of the chunk's bytes and a fingerprint of the pipeline's settings and code,
+so re-running after appending to a dataset only reprocesses the chunks that
+actually changed, while changing a filter reprocesses everything.
+
+Usage:
+    python prepare_dataset.py [--workers N] [--output-dir DIR] [--no-near-dup]
+"""
+
+import os
+import re
+import ast
+import glob
 import json
+import time
+import zlib
+import random
+import hashlib
+import inspect
+import argparse
+import unicodedata
+from multiprocessing import Pool
+
+from corpus_store import CorpusReader, is_sharded, iter_shard
+from dataset_reader import parse_json, JSON_ERRORS
+
+SOURCE_GLOB = "./datasets/*.jsonl"
+SHARDED_SOURCE_GLOB = "./datasets/*/index.jsonl"   # sharded corpora (see corpus_store.py)
+OUTPUT_DIR = "./finetune_data"
+CACHE_DIR = "./.prepare_cache"
+CHUNK_SIZE = 8 * 1024 * 1024        # bytes of input per process task
+SHARD_SIZE = 64 * 1024 * 1024       # bytes of output per shard
+MIN_CHARS = 20
+MAX_CHARS = 100_000
+
+NUM_PERM = 64                        # MinHash permutations
+LSH_BANDS = 16                       # NUM_PERM must be divisible by LSH_BANDS
+SHINGLE_WORDS = 5
+NEAR_DUP_THRESHOLD = 0.8
+
+_MERSENNE = (1 << 61) - 1
+_rng = random.Random(1234)           # fixed seed: signatures must be stable across runs
+_PERMS = [(_rng.randrange(1, _MERSENNE), _rng.randrange(0, _MERSENNE)) for _ in range(NUM_PERM)]
+
+_BLANK_LINES = re.compile(r"\n{3,}")
+_WORD = re.compile(r"\w+")
+_ENGLISH_WORDS = {"the", "and", "to", "of", "a", "in", "is", "it", "you", "that", "for", "with", "this", "as", "on"}
+
+
+# --- Stage 1: read ---
+
+def split_chunks(path, chunk_size=CHUNK_SIZE):
+    """
+    Split a source into (file, start, end) chunks: line-aligned byte ranges of roughly
+    chunk_size for a .jsonl file, or one chunk per shard for a sharded corpus directory.
+    """
+    if is_sharded(path):
+        # Only the indexed part of each shard; unindexed bytes are never read
+        reader = CorpusReader(path)
+        chunks = []
+        for shard in reader.shards():
+            entries = reader.shard_entries(shard)
+            if entries:
+                chunks.append((shard, 0, max(entry["offset"] + entry["length"] for entry in entries)))
+        return chunks
+
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()  # extend to the end of the current line
+            end = min(f.tell(), size)
+            chunks.append((path, start, end))
+            start = end
+    return chunks
+
+
+def chunk_digest(path, start, end):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start
+        while remaining:
+            block = f.read(min(remaining, 1024 * 1024))
+            if not block:
+                break
+            h.update(block)
+            remaining -= len(block)
+    return h.hexdigest()
+
+
+# --- Stage 2: process (normalise, filter, hash) ---
+
+def normalize_text(text):
+    text = unicodedata.normalize("NFC", text).replace("\r\n", "\n").replace("\r", "\n")
+    text = "\n".join(line.rstrip() for line in text.split("\n"))
+    return _BLANK_LINES.sub("\n\n", text).strip()
+
+
+def is_python(code):
+    try:
+        ast.parse(code)
+        return True
+    except (SyntaxError, ValueError):
+        return False
+
+
+def is_english(text):
+    """Cheap language check: mostly ASCII and a reasonable share of common English words."""
+    if not text:
+        return False
+    ascii_ratio = sum(1 for c in text if ord(c) < 128) / len(text)
+    words = _WORD.findall(text.lower())
+    if not words:
+        return False
+    common = sum(1 for w in words if w in _ENGLISH_WORDS) / len(words)
+    return ascii_ratio >= 0.9 and common >= 0.03
+
+
+def to_training_text(item):
+    """
+    Normalise a source record into training text, or return None if it is filtered out.
+    Instruction pairs become "# Task: ..." blocks (the format the models are prompted
+    with); crawled pages contribute their page text.
+    """
+    if isinstance(item.get("instruction"), str) and isinstance(item.get("code"), str):
+        instruction = normalize_text(item["instruction"])
+        code = normalize_text(item["code"])
+        if not instruction or not code or not is_python(code):
+            return None
+        text = f"# Task: {instruction}\n{code}"
+    elif isinstance(item.get("content"), str):
+        text = normalize_text(item["content"])
+        if not is_english(text):
+            return None
+    else:
+        return None
+
+    if not MIN_CHARS <= len(text) <= MAX_CHARS:
+        return None
+    return text
+
+
+def minhash(text):
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_WORDS:
+        shingles = {" ".join(words)}
+    else:
+        shingles = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+    values = [zlib.crc32(s.encode("utf-8")) for s in shingles]
+    return [min((a * v + b) % _MERSENNE for v in values) for a, b in _PERMS]
+
+
+def iter_chunk(path, start, end):
+    """Yield (record or None) for every non-blank line in a chunk; None marks unparsable lines."""
+    if path.endswith((".gz", ".zst")):
+        yield from iter_shard(path)
+        return
+
+    with open(path, "rb") as f:
+        f.seek(start)
+        while f.tell() < end:
+            line = f.readline()
+            if not line:
+                break
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                item = parse_json(line)
+            except JSON_ERRORS:
+                item = None
+            yield item if isinstance(item, dict) else None
+
+
+def process_chunk(task):
+    """Worker: turn one input chunk into cached, filtered records. Returns (read, kept)."""
+    path, start, end, cache_path, near_dup = task
+    records = []
+    read = 0
+    for item in iter_chunk(path, start, end):
+        read += 1
+        if item is None:
+            continue
+        text = to_training_text(item)
+        if text is None:
+            continue
+        records.append({
+            "text": text,
+            "hash": hashlib.sha256(text.encode("utf-8")).hexdigest(),
+            "minhash": minhash(text) if near_dup else None,
+        })
+
+    tmp_path = cache_path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    os.replace(tmp_path, cache_path)
+    return read, len(records)
+
+
+def pipeline_fingerprint(near_dup):
+    """
+    Identifies everything besides the input bytes that shapes a chunk's cached output:
+    the filter limits, MinHash parameters and the source of the processing functions.
+    Changing any of them invalidates the cache.
+    """
+    h = hashlib.sha1()
+    h.update(repr((MIN_CHARS, MAX_CHARS, sorted(_ENGLISH_WORDS), _BLANK_LINES.pattern, near_dup)).encode("utf-8"))
+    if near_dup:
+        h.update(repr((NUM_PERM, SHINGLE_WORDS, _PERMS)).encode("utf-8"))
+    for fn in (iter_chunk, normalize_text, is_python, is_english, to_training_text, minhash, process_chunk):
+        h.update(inspect.getsource(fn).encode("utf-8"))
+    return h.hexdigest()[:12]
 
-with open("./datasets/python_articles.jsonl", "r", encoding="utf-8") as fin, \
-     open("finetune_data.txt", "w", encoding="utf-8") as fout:
-    for line in fin:
-        try:
-            item = json.loads(line.strip())
-            instruction = item.get("instruction", "").strip()
-            code = item.get("code", "").strip()
-            if instruction and code:
-                fout.write(f"# Task: {instruction}\n{code}\n\n")
-        except json.JSONDecodeError:
+
+# --- Stage 3/4: dedup ---
+
+def iter_cached(cache_paths):
+    for cache_path in cache_paths:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+
+
+def estimated_jaccard(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class NearDupIndex:
+    """MinHash LSH index: a record is a near-duplicate if it shares a band with a similar kept record."""
+
+    def __init__(self, bands=LSH_BANDS, threshold=NEAR_DUP_THRESHOLD):
+        self.bands = bands
+        self.rows = NUM_PERM // bands
+        self.threshold = threshold
+        self.buckets = [dict() for _ in range(bands)]
+        self.signatures = []
+
+    def add_if_new(self, signature):
+        keys = [tuple(signature[b * self.rows:(b + 1) * self.rows]) for b in range(self.bands)]
+        candidates = set()
+        for bucket, key in zip(self.buckets, keys):
+            candidates.update(bucket.get(key, ()))
+        for idx in candidates:
+            if estimated_jaccard(signature, self.signatures[idx]) >= self.threshold:
+                return False
+
+        idx = len(self.signatures)
+        self.signatures.append(signature)
+        for bucket, key in zip(self.buckets, keys):
+            bucket.setdefault(key, []).append(idx)
+        return True
+
+
+# --- Stage 5: shard ---
+
+class ShardWriter:
+    def __init__(self, output_dir, shard_size=SHARD_SIZE):
+        self.output_dir = output_dir
+        self.shard_size = shard_size
+        self.shards = []
+        self._file = None
+        self._size = 0
+
+    def write(self, text):
+        data = f"{text}\n\n".encode("utf-8")
+        if self._file is None or self._size + len(data) > self.shard_size:
+            self._next_shard()
+        self._file.write(data)
+        self._size += len(data)
+
+    def _next_shard(self):
+        self.close()
+        path = os.path.join(self.output_dir, f"shard-{len(self.shards):05d}.txt")
+        self.shards.append(path)
+        self._file = open(path, "wb")
+        self._size = 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+# --- Driver ---
+
+class StageStats:
+    def __init__(self):
+        self.rows = []
+
+    def record(self, name, seconds, records_in, records_out, nbytes=None):
+        self.rows.append((name, seconds, records_in, records_out, nbytes))
+
+    def report(self):
+        print("\n📊 Pipeline throughput")
+        print(f"{'stage':<10}{'time (s)':>10}{'in':>10}{'out':>10}{'rec/s':>12}{'MB/s':>10}")
+        for name, seconds, records_in, records_out, nbytes in self.rows:
+            rate = records_in / seconds if seconds > 0 else float("inf")
+            mbps = f"{nbytes / seconds / 1e6:.1f}" if nbytes is not None and seconds > 0 else "-"
+            print(f"{name:<10}{seconds:>10.2f}{records_in:>10}{records_out:>10}{rate:>12.0f}{mbps:>10}")
+
+
+def run_pipeline(sources, output_dir=OUTPUT_DIR, cache_dir=CACHE_DIR, workers=None, near_dup=True):
+    stats = StageStats()
+    os.makedirs(cache_dir, exist_ok=True)
+    os.makedirs(output_dir, exist_ok=True)
+    cache_suffix = pipeline_fingerprint(near_dup)
+
+    # Stage 1: split sources into chunks and find which ones are not cached yet
+    t0 = time.perf_counter()
+    cache_paths, pending, total_bytes = [], [], 0
+    queued = set()
+    for source in sources:
+        for path, start, end in split_chunks(source):
+            total_bytes += end - start
+            digest = chunk_digest(path, start, end)
+            cache_path = os.path.join(cache_dir, f"{digest}.{cache_suffix}.jsonl")
+            cache_paths.append(cache_path)
+            # Identical chunks (e.g. a copied source) share one cache file; process it once
+            if cache_path not in queued and not os.path.exists(cache_path):
+                queued.add(cache_path)
+                pending.append((path, start, end, cache_path, near_dup))
+    stats.record("read", time.perf_counter() - t0, len(cache_paths), len(pending), total_bytes)
+    print(f"🔎 {len(cache_paths)} chunk(s) across {len(sources)} source(s); {len(pending)} changed")
+
+    # Stage 2: process changed chunks in parallel
+    t0 = time.perf_counter()
+    read = kept = 0
+    if pending:
+        pending_bytes = sum(end - start for _, start, end, _, _ in pending)
+        with Pool(processes=workers) as pool:
+            for r, k in pool.imap_unordered(process_chunk, pending):
+                read += r
+                kept += k
+    else:
+        pending_bytes = 0
+    stats.record("process", time.perf_counter() - t0, read, kept, pending_bytes)
+
+    # Stages 3-5: dedup across everything and write shards
+    for old in glob.glob(os.path.join(output_dir, "shard-*.txt")):
+        os.remove(old)
+
+    seen = set()
+    index = NearDupIndex() if near_dup else None
+    writer = ShardWriter(output_dir)
+    counts = {"dedup_in": 0, "dedup_out": 0, "near_out": 0}
+    timings = {"dedup": 0.0, "near-dup": 0.0, "shard": 0.0}
+
+    for record in iter_cached(cache_paths):
+        counts["dedup_in"] += 1
+
+        t = time.perf_counter()
+        is_dup = record["hash"] in seen
+        seen.add(record["hash"])
+        timings["dedup"] += time.perf_counter() - t
+        if is_dup:
             continue
+        counts["dedup_out"] += 1
+
+        if index is not None:
+            t = time.perf_counter()
+            is_new = index.add_if_new(record["minhash"])
+            timings["near-dup"] += time.perf_counter() - t
+            if not is_new:
+                continue
+        counts["near_out"] += 1
+
+        t = time.perf_counter()
+        writer.write(record["text"])
+        timings["shard"] += time.perf_counter() - t
+    writer.close()
+
+    stats.record("dedup", timings["dedup"], counts["dedup_in"], counts["dedup_out"])
+    if near_dup:
+        stats.record("near-dup", timings["near-dup"], counts["dedup_out"], counts["near_out"])
+    stats.record("shard", timings["shard"], counts["near_out"], counts["near_out"])
+
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "sources": sources,
+            "records": counts["near_out"],
+            "shards": [os.path.basename(p) for p in writer.shards],
+        }, f, indent=2)
+
+    # Drop cache entries for chunks that no longer exist in any source
+    live = set(cache_paths)
+    for cached in glob.glob(os.path.join(cache_dir, "*.jsonl")):
+        if cached not in live:
+            os.remove(cached)
+
+    stats.report()
+    print(f"\n✅ Wrote {counts['near_out']} record(s) to {len(writer.shards)} shard(s) in {output_dir}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build sharded fine-tuning data from ./datasets/*.jsonl")
+    parser.add_argument("--sources", nargs="*", help=f"Input JSONL files (default: {SOURCE_GLOB})")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: all cores)")
+    parser.add_argument("--no-near-dup", action="store_true", help="Skip MinHash near-duplicate removal")
+    args = parser.parse_args()
+
+    sources = args.sources or (
+        sorted(glob.glob(SOURCE_GLOB))
+        + sorted(os.path.dirname(p) for p in glob.glob(SHARDED_SOURCE_GLOB))
+    )
+    if not sources:
+        print(f"❌ No input files found matching {SOURCE_GLOB}")
+        exit(1)
+
+    run_pipeline(
+        sources,
+        output_dir=args.output_dir,
+        cache_dir=args.cache_dir,
+        workers=args.workers,
+        near_dup=not args.no_near_dup,
+    )
@@ -0,0 +1,161 @@
+# request_scheduler.py
+
+"""
+Admission control for generation requests.
+
+GenerationScheduler sits in front of the model:
+- at most `max_concurrent` generations run at once;
+- at most `max_queue` requests may wait for a slot - anything beyond that is
+  rejected immediately with OverloadedError (the web app answers 503), so a
+  burst of traffic cannot build an unbounded backlog;
+- every admitted request gets a deadline. The deadline, and a cancellation
+  check (e.g. "has the client disconnected?"), are passed down to generate()
+  as a StoppingCriteria, so decoding stops as soon as either fires.
+"""
+
+import time
+import socket
+import select
+import threading
+from contextlib import contextmanager
+
+from transformers import StoppingCriteria
+
+MAX_CONCURRENT = 1
+MAX_QUEUE = 4
+DEADLINE_SECONDS = 30.0
+CANCEL_CHECK_INTERVAL = 0.25   # seconds between (possibly syscall-heavy) cancellation checks
+
+
+class OverloadedError(Exception):
+    """Raised when a request cannot be admitted (queue full, or its deadline passed while queued)."""
+
+
+class RequestCancelled(Exception):
+    """Raised when a request is cancelled before it starts generating."""
+
+
+class Ticket:
+    def __init__(self, deadline, is_cancelled=None):
+        self.deadline = deadline
+        self._is_cancelled = is_cancelled
+        self._cancelled = False
+        self._last_check = 0.0
+        self.stop_reason = None
+
+    def remaining(self):
+        return self.deadline - time.monotonic()
+
+    def expired(self):
+        return time.monotonic() >= self.deadline
+
+    def cancelled(self):
+        """Poll the cancellation callback, at most once per CANCEL_CHECK_INTERVAL."""
+        if self._cancelled or self._is_cancelled is None:
+            return self._cancelled
+        now = time.monotonic()
+        if now - self._last_check >= CANCEL_CHECK_INTERVAL:
+            self._last_check = now
+            self._cancelled = bool(self._is_cancelled())
+        return self._cancelled
+
+    def cancel(self):
+        self._cancelled = True
+
+    def stopping_criteria(self):
+        return TicketStoppingCriteria(self)
+
+
+class TicketStoppingCriteria(StoppingCriteria):
+    """Stops generate() when the request's deadline passes or it is cancelled."""
+
+    def __init__(self, ticket):
+        self.ticket = ticket
+
+    def __call__(self, input_ids, scores, **kwargs):
+        if self.ticket.cancelled():
+            self.ticket.stop_reason = "cancelled"
+            return True
+        if self.ticket.expired():
+            self.ticket.stop_reason = "deadline"
+            return True
+        return False
+
+
+class GenerationScheduler:
+    def __init__(self, max_concurrent=MAX_CONCURRENT, max_queue=MAX_QUEUE, deadline_seconds=DEADLINE_SECONDS):
+        self.max_queue = max_queue
+        self.deadline_seconds = deadline_seconds
+        self._slots = threading.BoundedSemaphore(max_concurrent)
+        self._lock = threading.Lock()
+        self._waiting = 0
+        self.stats = {"admitted": 0, "rejected": 0, "expired_in_queue": 0, "cancelled": 0, "deadline_stops": 0}
+
+    @contextmanager
+    def admit(self, deadline_seconds=None, is_cancelled=None):
+        """
+        Wait for a generation slot and yield a Ticket. Raises OverloadedError if the
+        queue is full or the deadline passes while waiting, RequestCancelled if the
+        request is cancelled while waiting.
+        """
+        ticket = Ticket(time.monotonic() + (deadline_seconds or self.deadline_seconds), is_cancelled)
+
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                if self._waiting >= self.max_queue:
+                    self.stats["rejected"] += 1
+                    raise OverloadedError("Too many requests waiting for the model.")
+                self._waiting += 1
+            try:
+                self._wait_for_slot(ticket)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+
+        self._count("admitted")
+        try:
+            yield ticket
+        finally:
+            self._slots.release()
+            if ticket.stop_reason == "cancelled":
+                self._count("cancelled")
+            elif ticket.stop_reason == "deadline":
+                self._count("deadline_stops")
+
+    def _wait_for_slot(self, ticket):
+        while True:
+            remaining = ticket.remaining()
+            if remaining <= 0:
+                self._count("expired_in_queue")
+                raise OverloadedError("Deadline passed while waiting for the model.")
+            if self._slots.acquire(timeout=min(remaining, CANCEL_CHECK_INTERVAL)):
+                return
+            if ticket.cancelled():
+                self._count("cancelled")
+                raise RequestCancelled()
+
+    def _count(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self.stats, waiting=self._waiting)
+
+
+def client_disconnected(environ):
+    """
+    Best-effort check whether the HTTP client behind a WSGI request has gone away.
+    Works with the werkzeug server (which exposes the socket); returns False elsewhere.
+    """
+    sock = environ.get("werkzeug.socket")
+    if sock is None:
+        return False
+    try:
+        readable, _, _ = select.select([sock], [], [], 0)
+        if not readable:
+            return False
+        # The request body has already been read, so a readable socket means EOF or a reset
+        return sock.recv(1, socket.MSG_PEEK) == b""
+    except (OSError, ValueError):
+        return True
@@ -8,10 +8,13 @@ This script launches a simple REPL-like AI assistant that:
 - Works offline using locally cached Hugging Face models
 
 Usage:
-    python run_repl_ai.py [--offline]
+    python run_repl_ai.py [--offline] [--session]
 
 Arguments:
     --offline   Use only local files for the language model (no internet).
+    --session   Multi-turn session mode: the dataset context is encoded once and
+                its KV cache reused, so each turn only encodes the new task.
+                Uses MODEL_NAME (a causal model) instead of ./trained-model.
 
 Dependencies:
     pip install transformers torch
@@ -29,14 +32,18 @@ import json
 
 from transformers import AutoModelForCausalLM, AutoTokenizer
 from ai_core import generate_response, run_python_code, load_json_dataset
+from session_cache import ChatSession
 
 # --- Configuration ---
 
 MODEL_NAME = "gpt2"  # Default model
 CACHE_DIR = os.path.expanduser("~/.cache/huggingface/transformers")
 USE_OFFLINE = "--offline" in sys.argv  # Use --offline flag to avoid internet
+USE_SESSION = "--session" in sys.argv  # Reuse the context's KV cache across turns
+SESSION_CACHE_MB = 512                 # Memory cap for cached prefixes in session mode
 
 DATASET_PATH = "./datasets/python_articles.jsonl"
+MAX_CONTEXT_CHARS = 16000  # Cap on dataset context streamed into each prompt
 
 print(f"🔧 Loading model (offline={USE_OFFLINE})...")
 
@@ -80,6 +87,11 @@ def simulate_execution(code: str, lang: str):
 if __name__ == "__main__":
     print("🤖 PyThor — REPL AI Assistant\n")
 
+    session = None
+    if USE_SESSION:
+        session = ChatSession(model, tokenizer, max_bytes=SESSION_CACHE_MB * 1024 * 1024)
+        print(f"🧵 Session mode on (cache cap {SESSION_CACHE_MB} MB)\n")
+
     while True:
         user_input = input("🧠 Enter your instruction (type 'exit' to quit):\n> ").strip()
         if user_input.lower() in ["exit", "quit"]:
@@ -87,11 +99,17 @@ if __name__ == "__main__":
             break
 
         language = detect_language(user_input)
-        context = load_json_dataset(DATASET_PATH)
-        prompt = f"{context}\n\n# Task: {user_input}\n"
+        context = load_json_dataset(DATASET_PATH, max_chars=MAX_CONTEXT_CHARS)
 
         print(f"\n--- Attempting response using model: {MODEL_NAME} ---")
-        code = generate_response(prompt)
+        if session:
+            code = session.generate(f"{context}\n\n", f"# Task: {user_input}\n")
+            stats = session.stats()
+            print(f"⏱️ {stats['last_latency_s']:.2f}s (cache hits={stats['hits']}, "
+                  f"misses={stats['misses']}, {stats['cache_mb']:.1f} MB)")
+        else:
+            prompt = f"{context}\n\n# Task: {user_input}\n"
+            code = generate_response(prompt)
         print(f"\n--- Generated Code ({language}) ---\n{code}\n")
 
         if language == "python":
@@ -0,0 +1,132 @@
+# serve.py
+
+"""
+Production serving mode: pre-fork workers sharing one copy of the model weights.
+
+The master process imports the app (which loads ./trained-model once), freezes
+the garbage collector so it never touches those objects again, opens the
+listening socket and then forks the workers. Workers inherit the model
+copy-on-write and never write to the weights, so the physical pages stay
+shared. With --mmap the weights are additionally memory-mapped from the
+.safetensors files (see shared_weights.py) and live in the page cache.
+
+After start-up the master reports the cold-start time and, for every process,
+RSS, PSS and unique (USS) memory - USS is what each extra worker really costs.
+
+Usage (Linux/macOS; fork is not available on Windows):
+    python serve.py [--workers N] [--host 127.0.0.1] [--port 5000] [--mmap] [--report-interval SECONDS]
+"""
+
+import os
+import gc
+import sys
+import time
+import signal
+import socket
+import argparse
+
+import psutil
+
+start_time = time.perf_counter()
+
+
+def memory_report(pids):
+    print(f"\n{'process':<14}{'pid':>8}{'rss MB':>10}{'pss MB':>10}{'uss MB':>10}")
+    for label, pid in pids:
+        try:
+            info = psutil.Process(pid).memory_full_info()
+        except psutil.Error:
+            continue
+        pss = getattr(info, "pss", None)
+        pss_text = f"{pss / 2**20:>10.0f}" if pss is not None else f"{'-':>10}"
+        print(f"{label:<14}{pid:>8}{info.rss / 2**20:>10.0f}{pss_text}{info.uss / 2**20:>10.0f}")
+
+
+def run_worker(app, sock, host, port, threads):
+    import torch
+    from werkzeug.serving import make_server
+
+    torch.set_num_threads(threads)
+    # Threaded, so requests beyond the generation slots reach the app's GenerationScheduler,
+    # which queues or rejects them (503) instead of leaving them in the listen backlog
+    server = make_server(host, port, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-fork server for the PyThor web app.")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--mmap", action="store_true", help="Memory-map .safetensors weights instead of copying them.")
+    parser.add_argument("--report-interval", type=float, default=0,
+                        help="Repeat the memory report every N seconds (0 = only at start-up).")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        print("❌ Pre-fork serving needs os.fork (Linux/macOS). Use 'python app.py' on Windows.")
+        sys.exit(1)
+
+    if args.mmap:
+        os.environ["PYTHOR_MMAP_WEIGHTS"] = "1"
+
+    print(f"🔧 Loading model in master (mmap={args.mmap})...")
+    from app import app  # loads tokenizer + model via ai_core
+    load_seconds = time.perf_counter() - start_time
+
+    # Everything allocated so far is shared with the workers; keep the GC from writing to it
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(128)
+    sock.set_inheritable(True)
+
+    threads = max(1, (os.cpu_count() or 1) // args.workers)
+    workers = []
+    for _ in range(args.workers):
+        fork_start = time.perf_counter()
+        pid = os.fork()
+        if pid == 0:
+            signal.signal(signal.SIGINT, signal.SIG_DFL)
+            run_worker(app, sock, args.host, args.port, threads)
+            os._exit(0)
+        workers.append((pid, time.perf_counter() - fork_start))
+
+    print(f"✅ Cold start: model loaded in {load_seconds:.1f}s; "
+          f"{args.workers} worker(s) forked in {sum(t for _, t in workers) * 1000:.0f} ms "
+          f"({threads} torch thread(s) each), serving http://{args.host}:{args.port}")
+
+    pids = [("master", os.getpid())] + [(f"worker {i}", pid) for i, (pid, _) in enumerate(workers)]
+    time.sleep(1.0)
+    memory_report(pids)
+
+    def shutdown(signum, frame):
+        for pid, _ in workers:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    alive = {pid for pid, _ in workers}
+    while alive:
+        if args.report_interval > 0:
+            time.sleep(args.report_interval)
+            memory_report(pids)
+            pid, status = os.waitpid(-1, os.WNOHANG)
+            if pid == 0:
+                continue
+        else:
+            pid, status = os.wait()
+        alive.discard(pid)
+        print(f"⚠️ Worker {pid} exited with status {status}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+# session_cache.py
+
+"""
+KV-cache reuse for multi-turn REPL sessions.
+
+Every REPL turn sends the same long prefix (the dataset context) followed by a
+short task. PrefixCache runs the prefix through a causal model once and keeps
+its past-key-values; ChatSession then only has to encode the new suffix on
+each turn, so per-turn latency no longer grows with the size of the context.
+
+Cached prefixes are kept in LRU order and evicted once their combined size
+exceeds `max_bytes` (or there are more than `max_entries` of them).
+
+Only decoder-only (causal) models are supported: an encoder-decoder encoder
+attends in both directions, so the encoder states of a prefix change with
+whatever follows it and cannot be reused without changing the output.
+"""
+
+import copy
+import time
+from collections import OrderedDict
+
+import torch
+
+MAX_CACHE_BYTES = 512 * 1024 * 1024
+MAX_CACHE_ENTRIES = 4
+MAX_NEW_TOKENS = 150
+MAX_SUFFIX_TOKENS = 64   # longer suffixes keep their last tokens
+
+
+def past_nbytes(past):
+    """Size in bytes of a past-key-values structure (legacy tuples or a Cache object)."""
+    if hasattr(past, "to_legacy_cache"):
+        past = past.to_legacy_cache()
+    total = 0
+    for layer in past:
+        for tensor in layer:
+            total += tensor.numel() * tensor.element_size()
+    return total
+
+
+class CachedPrefix:
+    def __init__(self, input_ids, past):
+        self.input_ids = input_ids
+        self.past = past
+        self.nbytes = past_nbytes(past)
+
+
+class PrefixCache:
+    """
+    Prefix states keyed on the prefix text alone. Prefixes longer than
+    `max_prefix_tokens` keep their most recent tokens; the budget is fixed so the
+    same prefix always maps to the same entry, whatever suffix follows it.
+    """
+
+    def __init__(self, model, tokenizer, max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES,
+                 max_prefix_tokens=None):
+        if model.config.is_encoder_decoder:
+            raise ValueError("PrefixCache needs a decoder-only model; encoder states cannot be reused across prompts.")
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_bytes = max_bytes
+        self.max_entries = max_entries
+        self.max_prefix_tokens = max_prefix_tokens
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, prefix: str) -> CachedPrefix:
+        """Return the cached prefix state, computing (and possibly evicting) on a miss."""
+        entry = self.entries.get(prefix)
+        if entry is not None:
+            self.entries.move_to_end(prefix)
+            self.hits += 1
+            return entry
+
+        self.misses += 1
+        input_ids = self.tokenizer.encode(prefix, return_tensors="pt")
+        if self.max_prefix_tokens is not None and input_ids.shape[1] > self.max_prefix_tokens:
+            # Keep the most recent part of the context
+            input_ids = input_ids[:, -self.max_prefix_tokens:]
+
+        with torch.no_grad():
+            past = self.model(input_ids, use_cache=True).past_key_values
+
+        entry = CachedPrefix(input_ids, past)
+        if entry.nbytes > self.max_bytes:
+            # Too large to keep; use it for this turn only
+            return entry
+
+        self.entries[prefix] = entry
+        self.nbytes += entry.nbytes
+        self._evict()
+        return entry
+
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+
+    def _evict(self):
+        while self.entries and (self.nbytes > self.max_bytes or len(self.entries) > self.max_entries):
+            _, evicted = self.entries.popitem(last=False)
+            self.nbytes -= evicted.nbytes
+
+
+class ChatSession:
+    """Generates responses for (shared prefix, new suffix) prompts, reusing the prefix KV cache."""
+
+    def __init__(self, model, tokenizer, max_bytes=MAX_CACHE_BYTES, max_entries=MAX_CACHE_ENTRIES,
+                 max_new_tokens=MAX_NEW_TOKENS, max_suffix_tokens=MAX_SUFFIX_TOKENS):
+        self.model = model
+        self.tokenizer = tokenizer
+        self.max_suffix_tokens = max_suffix_tokens
+        self.max_positions = getattr(model.config, "n_positions", None) or tokenizer.model_max_length
+        # Fixed room in the position window for the suffix and the new tokens, so the
+        # prefix budget (and with it the cache entry) doesn't change from turn to turn
+        self.prefix_budget = max(self.max_positions - max_suffix_tokens - max_new_tokens, 0)
+        self.cache = PrefixCache(model, tokenizer, max_bytes=max_bytes, max_entries=max_entries,
+                                 max_prefix_tokens=self.prefix_budget)
+        self.last_latency = None
+
+    def generate(self, prefix: str, suffix: str, max_tokens=MAX_NEW_TOKENS) -> str:
+        start = time.perf_counter()
+        suffix_ids = self.tokenizer.encode(suffix, return_tensors="pt")[:, -self.max_suffix_tokens:]
+
+        if prefix and self.prefix_budget > 0:
+            entry = self.cache.get(prefix)
+            input_ids = torch.cat([entry.input_ids, suffix_ids], dim=-1)
+            # generate() extends Cache objects in place; legacy tuples are immutable
+            past = entry.past if isinstance(entry.past, tuple) else copy.deepcopy(entry.past)
+        else:
+            input_ids = suffix_ids
+            past = None
+        max_tokens = max(min(max_tokens, self.max_positions - input_ids.shape[1]), 0)
+
+        with torch.no_grad():
+            output = self.model.generate(
+                input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past,
+                max_new_tokens=max_tokens,
+                pad_token_id=self.tokenizer.eos_token_id,
+                eos_token_id=self.tokenizer.eos_token_id,
+                no_repeat_ngram_size=2,
+                repetition_penalty=1.2,
+                do_sample=False,
+                num_beams=1,  # beam search would need the cached prefix expanded per beam
+            )
+
+        generated_ids = output[0][input_ids.shape[-1]:]
+        result = self.tokenizer.decode(generated_ids, skip_special_tokens=True)
+        self.last_latency = time.perf_counter() - start
+
+        cleaned = [line for line in result.splitlines() if not line.strip().startswith("```")]
+        return "\n".join(cleaned).strip()
+
+    def stats(self):
+        return {
+            "hits": self.cache.hits,
+            "misses": self.cache.misses,
+            "entries": len(self.cache.entries),
+            "cache_mb": self.cache.nbytes / (1024 * 1024),
+            "last_latency_s": self.last_latency,
+        }
@@ -0,0 +1,111 @@
+# shared_weights.py
+
+"""
+Load a model with its weights memory-mapped straight from the .safetensors files.
+
+The weight tensors are views into a private (copy-on-write) mapping of the file,
+so they live in the OS page cache rather than in process memory. Every process
+that maps the same file - or every worker forked after loading - shares those
+physical pages, and loading is close to instant because nothing is copied.
+The weights must be treated as read-only (inference only).
+"""
+
+import os
+import glob
+import json
+import struct
+
+import torch
+from accelerate import init_empty_weights
+from transformers import AutoConfig, GenerationConfig
+
+SAFETENSORS_DTYPES = {
+    "F64": torch.float64,
+    "F32": torch.float32,
+    "F16": torch.float16,
+    "BF16": torch.bfloat16,
+    "I64": torch.int64,
+    "I32": torch.int32,
+    "I16": torch.int16,
+    "I8": torch.int8,
+    "U8": torch.uint8,
+    "BOOL": torch.bool,
+}
+
+
+def base_fingerprint(path):
+    """Identifies the weight files in a model directory; changes whenever they are rewritten."""
+    stamps = []
+    for name in sorted(os.listdir(path)):
+        if name.endswith((".safetensors", ".bin")):
+            stat = os.stat(os.path.join(path, name))
+            stamps.append(f"{name}:{stat.st_size}:{stat.st_mtime_ns}")
+    return "|".join(stamps)
+
+
+def mmap_safetensors(path):
+    """Return {name: tensor} for a .safetensors file, without copying tensor data."""
+    with open(path, "rb") as f:
+        header_len = struct.unpack("<Q", f.read(8))[0]
+        header = json.loads(f.read(header_len))
+
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    data_start = 8 + header_len
+    tensors = {}
+    for name, info in header.items():
+        if name == "__metadata__":
+            continue
+        dtype = SAFETENSORS_DTYPES[info["dtype"]]
+        shape = info["shape"]
+        start, end = info["data_offsets"]
+        itemsize = torch.tensor([], dtype=dtype).element_size()
+        offset = data_start + start
+
+        if offset % itemsize:
+            # Misaligned for this dtype (not produced by current safetensors); fall back to a copy
+            with open(path, "rb") as f:
+                f.seek(offset)
+                raw = bytearray(f.read(end - start))
+            tensors[name] = torch.frombuffer(raw, dtype=dtype).reshape(shape)
+            continue
+
+        tensor = torch.empty(0, dtype=dtype)
+        tensor.set_(storage, offset // itemsize, shape)
+        tensors[name] = tensor
+    return tensors
+
+
+def load_mmap_model(path, model_class):
+    """
+    Build `model_class` from the config at `path` and attach memory-mapped weights.
+    Falls back to a regular from_pretrained() if the checkpoint is not in safetensors format.
+    """
+    files = sorted(glob.glob(os.path.join(path, "*.safetensors")))
+    if not files:
+        print(f"⚠️ No .safetensors weights in {path}; loading normally (weights will not be shared).")
+        return model_class.from_pretrained(path)
+
+    config = AutoConfig.from_pretrained(path)
+    with init_empty_weights():
+        model = model_class.from_config(config)
+
+    state_dict = {}
+    for file in files:
+        state_dict.update(mmap_safetensors(file))
+
+    model.load_state_dict(state_dict, strict=False, assign=True)
+    model.tie_weights()
+
+    # from_config() only derives generation defaults from the model config
+    if os.path.exists(os.path.join(path, "generation_config.json")):
+        model.generation_config = GenerationConfig.from_pretrained(path)
+
+    tensors = list(model.named_parameters()) + list(model.named_buffers())
+    missing = [name for name, t in tensors if t.device.type == "meta"]
+    if missing:
+        raise RuntimeError(f"Checkpoint in {path} is missing weights: {missing[:5]}")
+
+    for param in model.parameters():
+        param.requires_grad_(False)
+    model.eval()
+    return model
@@ -20,14 +20,38 @@ def fixtokenizer(c):
 def app(c):
     c.run("python app.py")
 
+@task
+def serve(c, workers=4):
+    c.run(f"python serve.py --workers {workers} --mmap")
+
 @task
 def train(c):
     c.run("python train_model.py")
 
+@task
+def preparedata(c):
+    c.run("python prepare_dataset.py")
+
+@task
+def reextract(c):
+    c.run("python page_archive.py reextract")
+
 @task
 def traincodet5(c):
     c.run("python train_codet5.py")
 
+@task
+def trainadapter(c):
+    c.run("python train_adapter.py")
+
+@task
+def traincodet5ddp(c, nproc=4):
+    c.run(f"python train_codet5.py --nproc {nproc}")
+
+@task
+def scalingreport(c):
+    c.run("python train_codet5.py --scaling-report 1,2,4,N")
+
 @task
 def convertgpt2(c):
     c.run("python -m nbconvert --to script train_gpt2_colab.ipynb")
@@ -0,0 +1,179 @@
+# train_adapter.py
+
+"""
+Incremental LoRA fine-tuning on the rows added to the dataset since the last run.
+
+Instead of retraining ./trained-model on the whole dataset, this trains a small
+low-rank adapter (a few MB) on top of it using only the new rows. Each run
+continues from the previous adapter, so update time grows with the amount of
+new data, not with the size of the dataset. ai_core picks up a new adapter on
+its next request without restarting or reloading the base model.
+
+State is kept in ./adapters/state.json:
+    offset      bytes of the dataset already trained on
+    version     number of the latest adapter
+    latest      path of the latest adapter
+    base        fingerprint of the base model the adapters were trained against
+
+If the base model changes (e.g. after a full train_codet5.py run) the adapter
+history is reset and the next run starts from the beginning of the dataset.
+
+Usage:
+    python train_adapter.py [--epochs N] [--rank R]
+
+Requires the `peft` package (pip install peft).
+"""
+
+import os
+import sys
+import json
+import argparse
+
+import torch
+from datasets import Dataset
+from transformers import (
+    AutoTokenizer,
+    AutoModelForSeq2SeqLM,
+    Trainer,
+    TrainingArguments,
+    DataCollatorForSeq2Seq
+)
+
+try:
+    from peft import LoraConfig, PeftModel, TaskType, get_peft_model
+except ImportError:
+    print("❌ Adapter training needs the 'peft' package: pip install peft")
+    sys.exit(1)
+
+from dataset_reader import parse_json, instruction_pair, JSON_ERRORS
+from shared_weights import base_fingerprint
+from train_codet5 import tokenize_function
+
+INPUT_FILE = "./datasets/python_articles.jsonl"
+BASE_MODEL = "./trained-model"
+ADAPTER_DIR = "./adapters"
+STATE_FILE = os.path.join(ADAPTER_DIR, "state.json")
+BATCH_SIZE = 4
+EPOCHS = 3
+LORA_RANK = 8
+LORA_ALPHA = 16
+LORA_DROPOUT = 0.05
+LORA_TARGET_MODULES = ["q", "v"]   # T5 attention query/value projections
+
+
+def load_state():
+    if os.path.exists(STATE_FILE):
+        with open(STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    return {"offset": 0, "version": 0, "latest": None, "base": None}
+
+
+def save_state(state):
+    os.makedirs(ADAPTER_DIR, exist_ok=True)
+    tmp = STATE_FILE + ".tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, indent=2)
+    os.replace(tmp, STATE_FILE)  # atomic, so ai_core never sees a half-written state
+
+
+def read_new_rows(path, offset):
+    """Instruction/code pairs from complete lines after `offset`; returns (examples, new offset)."""
+    examples = []
+    with open(path, "rb") as f:
+        f.seek(offset)
+        for line in f:
+            if not line.endswith(b"\n"):
+                break  # partial line still being written
+            offset += len(line)
+            try:
+                example = instruction_pair(parse_json(line))
+            except JSON_ERRORS:
+                continue
+            if example is not None:
+                examples.append(example)
+    return examples, offset
+
+
+def main(epochs=EPOCHS, rank=LORA_RANK):
+    state = load_state()
+    fingerprint = base_fingerprint(BASE_MODEL)
+    if state["base"] != fingerprint:
+        if state["base"] is not None:
+            print("ℹ️ Base model changed since the last adapter; starting a fresh adapter history.")
+        state = {"offset": 0, "version": state["version"], "latest": None, "base": fingerprint}
+
+    if os.path.getsize(INPUT_FILE) < state["offset"]:
+        # File was truncated or rewritten; start over
+        print("ℹ️ Dataset is smaller than at the last run; reading it from the start.")
+        state["offset"] = 0
+
+    examples, new_offset = read_new_rows(INPUT_FILE, state["offset"])
+    if not examples:
+        print("✅ No new rows since the last adapter; nothing to do.")
+        return
+    print(f"[OK] {len(examples)} new example(s) since byte {state['offset']}")
+
+    tokenizer = AutoTokenizer.from_pretrained(BASE_MODEL)
+    base = AutoModelForSeq2SeqLM.from_pretrained(BASE_MODEL)
+
+    if state["latest"] and os.path.isdir(state["latest"]):
+        print(f"🔁 Continuing from adapter {state['latest']}")
+        model = PeftModel.from_pretrained(base, state["latest"], is_trainable=True)
+    else:
+        config = LoraConfig(
+            task_type=TaskType.SEQ_2_SEQ_LM,
+            r=rank,
+            lora_alpha=LORA_ALPHA,
+            lora_dropout=LORA_DROPOUT,
+            target_modules=LORA_TARGET_MODULES,
+        )
+        model = get_peft_model(base, config)
+    model.print_trainable_parameters()
+
+    dataset = Dataset.from_list(examples)
+    tokenized_dataset = dataset.map(
+        lambda x: tokenize_function(x, tokenizer),
+        batched=True,
+        remove_columns=["input", "output"]
+    )
+
+    training_args = TrainingArguments(
+        output_dir="./output-adapter",
+        overwrite_output_dir=True,
+        per_device_train_batch_size=BATCH_SIZE,
+        num_train_epochs=epochs,
+        learning_rate=1e-4,
+        logging_strategy="steps",
+        logging_steps=10,
+        save_strategy="no",
+        report_to="none",
+        fp16=torch.cuda.is_available(),
+    )
+
+    trainer = Trainer(
+        model=model,
+        args=training_args,
+        train_dataset=tokenized_dataset,
+        data_collator=DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model),
+    )
+    trainer.train()
+
+    version = state["version"] + 1
+    adapter_path = os.path.join(ADAPTER_DIR, f"adapter-{version:04d}")
+    model.save_pretrained(adapter_path)
+
+    save_state({"offset": new_offset, "version": version, "latest": adapter_path, "base": fingerprint})
+    print(f"📦 Adapter saved to: {adapter_path} (trained on {len(examples)} new example(s))")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Train a LoRA adapter on dataset rows added since the last run.")
+    parser.add_argument("--epochs", type=int, default=EPOCHS)
+    parser.add_argument("--rank", type=int, default=LORA_RANK, help="LoRA rank for a new adapter.")
+    args = parser.parse_args()
+
+    if not os.path.exists(INPUT_FILE):
+        print(f"❌ Input file not found: {INPUT_FILE}")
+        sys.exit(1)
+
+    main(epochs=args.epochs, rank=args.rank)
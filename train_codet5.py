@@ -1,9 +1,13 @@
 # train_codet5.py
 
 import os
+import sys
 import json
+import argparse
+import tempfile
+import subprocess
 import torch
-from datasets import Dataset
+from datasets import Dataset, IterableDataset
 from transformers import (
     AutoTokenizer,
     AutoModelForSeq2SeqLM,
@@ -12,6 +16,8 @@ from transformers import (
     DataCollatorForSeq2Seq
 )
 
+from dataset_reader import iter_instruction_pairs
+
 # Suppress symlink warning if on Windows
 os.environ["HF_HUB_DISABLE_SYMLINKS_WARNING"] = "1"
 
@@ -24,22 +30,30 @@ EPOCHS = 10
 MAX_LENGTH = 512
 
 
-def load_dataset(jsonl_path):
-    examples = []
-    with open(jsonl_path, "r", encoding="utf-8") as f:
-        for line in f:
-            try:
-                item = json.loads(line.strip())
-                if "instruction" in item and "code" in item:
-                    instruction = item["instruction"].strip()
-                    code = item["code"].strip()
-                    if instruction and code:
-                        examples.append({"input": instruction, "output": code})
-            except json.JSONDecodeError:
-                continue
-    print(f"[OK] Loaded {len(examples)} examples from {jsonl_path}")
+def _examples(path, stamp=None):
+    yield from iter_instruction_pairs(path)
+
+def load_dataset(jsonl_path, streaming=False):
+    """
+    Build the training dataset by streaming examples straight from the JSONL file.
+    The regular mode writes them to an on-disk Arrow cache via Dataset.from_generator
+    (memory-mapped, so it never sits fully in RAM); with streaming=True an
+    IterableDataset is returned and examples are read lazily while training.
+    """
+    if streaming:
+        print(f"[OK] Streaming examples from {jsonl_path}")
+        return IterableDataset.from_generator(iter_instruction_pairs, gen_kwargs={"path": jsonl_path})
+
+    # The file's size/mtime are part of the generator kwargs so the Arrow cache is
+    # rebuilt whenever new rows are appended, rather than served stale.
+    stat = os.stat(jsonl_path)
+    dataset = Dataset.from_generator(
+        _examples,
+        gen_kwargs={"path": jsonl_path, "stamp": (stat.st_size, stat.st_mtime_ns)}
+    )
+    print(f"[OK] Loaded {len(dataset)} examples from {jsonl_path}")
 
-    return Dataset.from_list(examples)
+    return dataset
 
 def tokenize_function(example, tokenizer):
     model_inputs = tokenizer(
@@ -59,31 +73,73 @@ def tokenize_function(example, tokenizer):
     return model_inputs
 
 
-def main():
-    # Load tokenizer and model
-    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
-    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
-    tokenizer.pad_token = tokenizer.eos_token
+def cpu_supports_bf16():
+    """True if the CPU has native bf16 instructions (AVX512-BF16 or AMX), so autocast pays off."""
+    try:
+        with open("/proc/cpuinfo", "r", encoding="utf-8") as f:
+            flags = f.read()
+    except OSError:
+        return False
+    return "avx512_bf16" in flags or "amx_bf16" in flags
 
-    # Load and tokenize dataset
-    dataset = load_dataset(INPUT_FILE)
-    tokenized_dataset = dataset.map(lambda x: tokenize_function(x, tokenizer), batched=True)
+
+def is_distributed_worker():
+    return "LOCAL_RANK" in os.environ
+
+
+def launch_distributed(nproc, argv):
+    """Re-run this script under torch.distributed.run with `nproc` CPU processes (gloo backend)."""
+    env = dict(os.environ)
+    # Split the cores between processes so they don't oversubscribe each other
+    env["OMP_NUM_THREADS"] = str(max(1, (os.cpu_count() or 1) // nproc))
+    cmd = [
+        sys.executable, "-m", "torch.distributed.run",
+        "--standalone", f"--nproc_per_node={nproc}",
+        os.path.abspath(__file__), *argv,
+    ]
+    return subprocess.call(cmd, env=env)
+
+
+def main(streaming=False, max_steps=-1, grad_accum=1, grad_checkpointing=False,
+         bf16=False, save=True, metrics_file=None):
+    distributed = is_distributed_worker()
 
     # Training arguments
     training_args = TrainingArguments(
         output_dir="./output",
         overwrite_output_dir=True,
         per_device_train_batch_size=BATCH_SIZE,
+        gradient_accumulation_steps=grad_accum,
+        gradient_checkpointing=grad_checkpointing,
         num_train_epochs=EPOCHS,
+        max_steps=max_steps,
         logging_dir="./logs",
         logging_strategy="steps",
         logging_steps=10,
-        save_strategy="epoch",
+        save_strategy="epoch" if save else "no",
         report_to="none",
         fp16=torch.cuda.is_available(),
+        bf16=bf16,
+        use_cpu=distributed or bf16,
+        ddp_backend="gloo" if distributed else None,
+        ddp_find_unused_parameters=False if distributed else None,
         save_total_limit=2
     )
 
+    # Load tokenizer and model
+    tokenizer = AutoTokenizer.from_pretrained(MODEL_NAME)
+    model = AutoModelForSeq2SeqLM.from_pretrained(MODEL_NAME)
+    tokenizer.pad_token = tokenizer.eos_token
+
+    # Load and tokenize dataset (rank 0 builds the cache, the other ranks reuse it)
+    with training_args.main_process_first(desc="dataset"):
+        dataset = load_dataset(INPUT_FILE, streaming=streaming)
+        tokenized_dataset = dataset.map(
+            lambda x: tokenize_function(x, tokenizer),
+            batched=True,
+            remove_columns=["input", "output"]
+        )
+
     # Collator
     data_collator = DataCollatorForSeq2Seq(tokenizer=tokenizer, model=model)
 
@@ -96,18 +152,107 @@ def main():
     )
 
     # Start training
-    trainer.train()
+    result = trainer.train()
+    if not trainer.is_world_process_zero():
+        return
+
     print("✅ Training complete.")
+    if metrics_file:
+        with open(metrics_file, "w", encoding="utf-8") as f:
+            json.dump(result.metrics, f)
 
     # Save model
-    model.save_pretrained(OUTPUT_DIR)
-    tokenizer.save_pretrained(OUTPUT_DIR)
-    print(f"📦 Model saved to: {OUTPUT_DIR}")
+    if save:
+        model.save_pretrained(OUTPUT_DIR)
+        tokenizer.save_pretrained(OUTPUT_DIR)
+        print(f"📦 Model saved to: {OUTPUT_DIR}")
+
+
+def scaling_report(process_counts, steps, argv):
+    """Run a short benchmark at each process count and print samples/sec and scaling efficiency."""
+    rows = []
+    for nproc in process_counts:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as tmp:
+            metrics_file = tmp.name
+        print(f"\n⏱️ Benchmarking {nproc} process(es) for {steps} step(s)...")
+        bench_argv = [*argv, "--max-steps", str(steps), "--no-save", "--metrics-file", metrics_file]
+        if nproc > 1:
+            code = launch_distributed(nproc, bench_argv)
+        else:
+            code = subprocess.call([sys.executable, os.path.abspath(__file__), *bench_argv])
+
+        samples_per_second = None
+        if code == 0 and os.path.getsize(metrics_file):
+            with open(metrics_file, "r", encoding="utf-8") as f:
+                samples_per_second = json.load(f).get("train_samples_per_second")
+        os.remove(metrics_file)
+        rows.append((nproc, samples_per_second))
+
+    baseline = rows[0][1]
+    print(f"\n{'processes':>10}{'samples/s':>12}{'speedup':>10}{'efficiency':>12}")
+    for nproc, sps in rows:
+        if sps is None:
+            print(f"{nproc:>10}{'failed':>12}")
+            continue
+        speedup = sps / baseline if baseline else 0.0
+        print(f"{nproc:>10}{sps:>12.2f}{speedup:>9.2f}x{speedup / nproc * rows[0][0]:>11.0%}")
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fine-tune CodeT5 on the instruction/code dataset.")
+    parser.add_argument("--streaming", action="store_true",
+                        help="Read examples lazily (IterableDataset) instead of building an Arrow cache.")
+    parser.add_argument("--max-steps", type=int, default=-1,
+                        help="Total optimizer steps; required with --streaming.")
+    parser.add_argument("--nproc", type=int, default=1,
+                        help="Data-parallel CPU processes on this machine (torch.distributed, gloo backend).")
+    parser.add_argument("--grad-accum", type=int, default=1, help="Gradient accumulation steps.")
+    parser.add_argument("--grad-checkpointing", action="store_true",
+                        help="Recompute activations in the backward pass to save memory.")
+    parser.add_argument("--bf16", choices=["auto", "on", "off"], default="auto",
+                        help="bf16 autocast on CPU; 'auto' enables it only if the CPU has native bf16 support.")
+    parser.add_argument("--scaling-report", metavar="COUNTS",
+                        help="Comma-separated process counts to benchmark, e.g. 1,2,4,N (N = all cores).")
+    parser.add_argument("--benchmark-steps", type=int, default=20)
+    parser.add_argument("--no-save", action="store_true", help=argparse.SUPPRESS)
+    parser.add_argument("--metrics-file", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
     if not os.path.exists(INPUT_FILE):
         print(f"❌ Input file not found: {INPUT_FILE}")
         exit(1)
 
-    main()
+    if args.streaming and args.max_steps <= 0 and not args.scaling_report:
+        print("❌ --max-steps is required with --streaming (an IterableDataset has no length).")
+        exit(1)
+
+    # Options passed through to each launched training process
+    passthrough = [f"--grad-accum={args.grad_accum}", f"--bf16={args.bf16}"]
+    if args.grad_checkpointing:
+        passthrough.append("--grad-checkpointing")
+    if args.streaming:
+        passthrough.append("--streaming")
+
+    if args.scaling_report:
+        counts = [(os.cpu_count() or 1) if c.strip().upper() == "N" else int(c) for c in args.scaling_report.split(",")]
+        scaling_report(counts, args.benchmark_steps, passthrough)
+        exit(0)
+
+    if args.nproc > 1 and not is_distributed_worker():
+        argv = [*passthrough, f"--max-steps={args.max_steps}"]
+        if args.no_save:
+            argv.append("--no-save")
+        if args.metrics_file:
+            argv.append(f"--metrics-file={args.metrics_file}")
+        exit(launch_distributed(args.nproc, argv))
+
+    use_bf16 = args.bf16 == "on" or (args.bf16 == "auto" and not torch.cuda.is_available() and cpu_supports_bf16())
+    main(
+        streaming=args.streaming,
+        max_steps=args.max_steps,
+        grad_accum=args.grad_accum,
+        grad_checkpointing=args.grad_checkpointing,
+        bf16=use_bf16,
+        save=not args.no_save,
+        metrics_file=args.metrics_file,
+    )
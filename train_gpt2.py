@@ -10,7 +10,8 @@ cache_dir = os.path.expanduser("~/.cache/huggingface/transformers")
 tokenizer = GPT2Tokenizer.from_pretrained(model_name, cache_dir=cache_dir)
 tokenizer.pad_token = tokenizer.eos_token  # GPT-2 has no pad token
 
-dataset = load_dataset("text", data_files={"train": "finetune_data.txt"})
+# Shards produced by prepare_dataset.py
+dataset = load_dataset("text", data_files={"train": "finetune_data/shard-*.txt"})
 
 def tokenize_function(example):
     return tokenizer(example["text"], truncation=True, padding="max_length", max_length=512)